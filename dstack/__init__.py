@@ -1,18 +1,24 @@
 import base64
-import json
-import os
+import threading
 import typing as ty
-from functools import wraps
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
 from deprecation import deprecated
 
 from dstack.auto import AutoHandler
+from dstack.budget import set_budget, BudgetExceededError
+from dstack.cache_manager import CacheManager, get_cache_manager, ObjectCache, get_object_cache, set_object_cache, \
+    WarmReport, CacheIntegrityError
 from dstack.config import Config, ConfigFactory, YamlConfigFactory, \
     from_yaml_file, ConfigurationError, get_config, Profile, _get_config_path
-from dstack.content import StreamContent, BytesContent, MediaType, FileContent
+from dstack.content import StreamContent, BytesContent, MediaType, FileContent, Content
 from dstack.context import Context
 from dstack.handler import Encoder, Decoder, T, DecoratedValue
-from dstack.protocol import Protocol, JsonProtocol, MatchError, create_protocol
-from dstack.stack import EncryptionMethod, NoEncryption, StackFrame, merge_or_none, FrameData, PushResult, FrameMeta
+from dstack.memo import cache, default_hash_func, CacheInfo, content_hash_func, pandas_hash_func, numpy_hash_func, \
+    control_hash_func
+from dstack.protocol import Protocol, JsonProtocol, MatchError, create_protocol, RemoteContent, match
+from dstack.stack import EncryptionMethod, NoEncryption, StackFrame, merge_or_none, FrameData, PushResult, FrameMeta, \
+    BatchPushResult, ObjectModifiedError, GridFailure
 from dstack.application import Application
 
 
@@ -49,6 +55,66 @@ def push(stack: str, obj, description: ty.Optional[str] = None,
     return f.push(meta)
 
 
+def push_batch(items: ty.Iterable[ty.Union[ty.Tuple[str, ty.Any], ty.Dict[str, ty.Any]]],
+               access: ty.Optional[str] = None,
+               meta: ty.Optional[FrameMeta] = None,
+               profile: str = "default",
+               raise_errors: bool = False) -> ty.List[BatchPushResult]:
+    """Push many objects to many stacks at once. Every object becomes a single frame in its own stack.
+    Frames are grouped by profile and sent by one protocol per profile, so connections to the server are reused.
+
+    Args:
+        items: Objects to push. Every item is either a pair `(stack, obj)` or a dictionary with `stack` and `obj` keys
+            and any optional `push` arguments: `description`, `access`, `meta`, `params`, `encoder`, `profile`.
+        access: Default access level for all stacks.
+        meta: Default push message for all frames.
+        profile: Default profile.
+        raise_errors: Raise the first error after all frames are pushed instead of reporting it in the result.
+
+    Returns:
+        Results in the same order as items, every result contains either push result or an error.
+    """
+    results: ty.List[ty.Optional[BatchPushResult]] = []
+    groups: ty.Dict[str, ty.List[ty.Tuple[int, StackFrame, ty.Dict]]] = {}
+    contexts: ty.Dict[str, Context] = {}
+
+    for item in items:
+        item = dict(item) if isinstance(item, ty.Mapping) else {"stack": item[0], "obj": item[1]}
+        stack = item["stack"]
+        item_profile = item.get("profile", profile)
+
+        try:
+            if item_profile not in contexts:
+                contexts[item_profile] = create_context(stack, item_profile)
+            context = contexts[item_profile].derive(stack)
+            f = _create_frame(context, access=item.get("access", access))
+            f.add(item["obj"], item.get("description"), item.get("params"), item.get("encoder"))
+            data = f.build_push(item.get("meta", meta))
+            groups.setdefault(item_profile, []).append((len(results), f, data))
+            results.append(None)
+        except Exception as e:
+            results.append(BatchPushResult(stack, error=e))
+
+    for item_profile, frames in groups.items():
+        context = contexts[item_profile]
+        responses = context.protocol.push_batch([(f.context.stack_path(), data) for _, f, data in frames],
+                                                context.profile.token)
+        for (index, f, _), res in zip(frames, responses):
+            f.release(f.data)
+            stack = f.context.stack
+            if isinstance(res, Exception):
+                results[index] = BatchPushResult(stack, error=res)
+            else:
+                results[index] = BatchPushResult(stack, result=PushResult(f.id, res["url"]))
+
+    if raise_errors:
+        for r in results:
+            if not r.is_ok():
+                raise r.error
+
+    return results
+
+
 @deprecated(details="Use push instead")
 def push_frame(stack: str, obj, description: ty.Optional[str] = None,
                access: ty.Optional[str] = None,
@@ -82,7 +148,11 @@ def frame(stack: str,
           profile: str = "default",
           access: ty.Optional[str] = None,
           auto_push: bool = False,
-          check_access: bool = True) -> StackFrame:
+          check_access: bool = True,
+          executor: ty.Optional[Executor] = None,
+          lazy: bool = False,
+          memory_limit: ty.Optional[int] = None,
+          page_size: ty.Optional[int] = None) -> StackFrame:
     """Create a new stack frame. The method also checks access to specified stack.
 
     Args:
@@ -114,6 +184,14 @@ def frame(stack: str,
             want to see result immediately. Default is False.
         check_access: Check access to be sure about credentials before trying to actually push something.
             Default is `True`.
+        executor: Optional thread or process pool to encode objects in parallel. If it is specified `add`
+            doesn't wait for the object to be encoded, `push` waits for all objects instead.
+        lazy: Defer encoding of objects until `push`. An object added with the same parameters as a previous one
+            replaces it. Objects must not be modified after they are added.
+        memory_limit: Maximum number of bytes of encoded objects the frame keeps in memory, the rest of objects are
+            spilled to a temporary directory until `push`. By default there is no limit.
+        page_size: Maximum number of attachments sent in a single request, larger frames are pushed page by page
+            and committed afterwards. Default is `StackFrame.PAGE_SIZE`.
 
     Returns:
         A new stack frame.
@@ -127,7 +205,8 @@ def frame(stack: str,
 
     context = create_context(stack, profile)
 
-    return _create_frame(context, access=access, auto_push=auto_push, check_access=check_access)
+    return _create_frame(context, access=access, auto_push=auto_push, check_access=check_access, executor=executor,
+                         lazy=lazy, memory_limit=memory_limit, page_size=page_size)
 
 
 @deprecated(details="Use frame instead")
@@ -179,11 +258,17 @@ def create_frame(stack: str,
 
 
 def _create_frame(context: Context, access: ty.Optional[str] = None, auto_push: bool = False,
-                  check_access: bool = True) -> StackFrame:
+                  check_access: bool = True, executor: ty.Optional[Executor] = None,
+                  lazy: bool = False, memory_limit: ty.Optional[int] = None,
+                  page_size: ty.Optional[int] = None) -> StackFrame:
     frame = StackFrame(context,
                        access=access,
                        auto_push=auto_push,
-                       encryption=get_encryption(context.profile))
+                       encryption=get_encryption(context.profile),
+                       executor=executor,
+                       lazy=lazy,
+                       memory_limit=memory_limit,
+                       page_size=page_size)
     if check_access:
         frame.send_access()
 
@@ -209,61 +294,224 @@ def get_encryption(profile: Profile) -> EncryptionMethod:
 
 
 # TODO: Write tests that ensures that cache works
-def pull_data(context: Context, params: ty.Optional[ty.Dict] = None, **kwargs) -> FrameData:
-    path = context.stack_path()
-    params = merge_or_none(params, kwargs)
+def pull_data(context: Context, params: ty.Optional[ty.Dict] = None, lazy: bool = False,
+              head_ttl: ty.Optional[float] = None, frame: ty.Optional[str] = None,
+              attach_index: ty.Optional[int] = None, **kwargs) -> FrameData:
+    """Pull attachment data of the stack head or of the specific frame.
+
+    Args:
+        context: Stack context.
+        params: Parameters of the attachment.
+        lazy: Don't download the attachment which is stored on the server as a file, instead return
+            `RemoteContent`, so decoders can read only required bytes by `Content.range`.
+        head_ttl: Number of seconds the cached stack head is used without asking the server,
+            overrides `head_ttl` of the profile.
+        frame: Id of the frame to pull instead of the head. Frames are immutable, so a frame which
+            was pulled before is served from the local cache without asking the server.
+        attach_index: Index of the attachment to pull instead of matching parameters.
+        **kwargs: Parameters, an alternative to params.
+
+    Returns:
+        Frame data.
+    """
+    frame_id, index, attach = _pull_attach(context, merge_or_none(params, kwargs), head_ttl, frame, attach_index)
+    return _frame_data(context, frame_id, index, attach, lazy, head=frame is None)
+
+
+def _pull_attach(context: Context, params: ty.Optional[ty.Dict],
+                 head_ttl: ty.Optional[float] = None,
+                 frame: ty.Optional[str] = None,
+                 attach_index: ty.Optional[int] = None) -> ty.Tuple[str, int, ty.Dict]:
+    cache = get_cache_manager()
+    stack = context.stack_path()
+
+    if frame is not None:
+        meta = None
+        if attach_index is None:
+            meta = cache.get_frame(stack, frame)
+            if meta is None:
+                meta = context.protocol.pull_frame(stack, context.profile.token, frame)
+                cache.put_frame(stack, meta)
+    else:
+        head_ttl = context.profile.head_ttl if head_ttl is None else head_ttl
+        if head_ttl is None and attach_index is None:
+            frame, index, res = context.protocol.pull(stack, context.profile.token, params)
+            return frame, index, res["attachment"]
+        meta = _cached_head(context, head_ttl) if head_ttl is not None else _refresh_head(context)
+        frame = meta["id"]
+
+    index = attach_index if attach_index is not None else match(meta["attachments"], params)
+    attach = cache.get_attach(stack, frame, index)
+    # cached metadata has no data and its download URL may be expired, so it is used only with cached data
+    if attach is None or cache.find(stack, frame, index, attach) is None:
+        attach = context.protocol.pull_attach(stack, context.profile.token, frame, index)["attachment"]
+    return frame, index, attach
+
 
-    # TODO: Split context.protocol.pull into to pull_head and pull_frame
-    frame, index, res = context.protocol.pull(path, context.profile.token, params)
-    attach = res["attachment"]
+__head_refreshes: ty.Set[str] = set()
+__head_refreshes_lock = threading.Lock()
 
-    data = _cache_attach_data(attach, context, frame, index, path)
+
+def _cached_head(context: Context, ttl: float) -> ty.Dict:
+    """Return the head of the stack from the cache if it is younger than `ttl` seconds. An older head is returned
+    as well but it is refreshed in background, so the next pull gets the new head. The server is requested
+    synchronously only if the head has never been pulled.
+    """
+    cache = get_cache_manager()
+    stack = context.stack_path()
+    cached = cache.get_remote_head(stack)
+    if cached is None:
+        return _refresh_head(context)
+
+    head, fetched = cached
+    if time.time() - fetched >= ttl:
+        with __head_refreshes_lock:
+            if stack in __head_refreshes:
+                return head
+            __head_refreshes.add(stack)
+        threading.Thread(target=_refresh_head, args=(context, True), daemon=True).start()
+    return head
+
+
+def _refresh_head(context: Context, background: bool = False) -> ty.Dict:
+    stack = context.stack_path()
+    try:
+        head = context.protocol.pull_head(stack, context.profile.token)
+        get_cache_manager().put_remote_head(stack, head)
+        return head
+    except Exception:
+        if not background:
+            raise
+    finally:
+        if background:
+            with __head_refreshes_lock:
+                __head_refreshes.discard(stack)
+
+
+def _frame_data(context: Context, frame: str, index: int, attach: ty.Dict, lazy: bool = False,
+                head: bool = True) -> FrameData:
+    if lazy and "download_url" in attach:
+        data = RemoteContent(context.protocol, attach["download_url"], attach.get("length", None))
+    else:
+        data = _cache_attach_data(attach, context, frame, index, context.stack_path(), head)
 
     media_type = MediaType(attach["content_type"], attach.get("application", None))
     return FrameData(data, media_type, attach.get("description", None),
                      attach.get("params", None), attach.get("settings", None))
 
 
-def _cache_attach_data(attach, context, frame, index, path):
-    cache_dir = _get_config_path().parent / "cache"
-    file = cache_dir / "files" / os.sep.join(path.split("/")) / frame / str(index)
-    attach_file = cache_dir / "attachs" / os.sep.join(path.split("/")) / frame / (str(index) + ".json")
-    if not file.exists() or not attach_file.exists() or file.stat().st_size != attach.get("length"):
-        data = BytesContent(base64.b64decode(attach["data"])) if "data" in attach else \
-            StreamContent(*context.protocol.download(attach["download_url"]))
+def _cache_attach_data(attach, context, frame, index, path, head=True):
+    return FileContent(get_cache_manager().get_or_put(path, frame, index, attach,
+                                                      lambda: _load_attach(attach, context), head))
 
-        if file.exists():
-            os.remove(file)
-        if attach_file.exists():
-            os.remove(attach_file)
 
-        file.parent.mkdir(parents=True, exist_ok=True)
-        data.to_file(file, show_progress=False)
+def _load_attach(attach: ty.Dict, context: Context) -> Content:
+    return BytesContent(base64.b64decode(attach["data"])) if "data" in attach else \
+        StreamContent(*context.protocol.download(attach["download_url"]))
 
-        attach_file.parent.mkdir(parents=True, exist_ok=True)
-        with open(attach_file, 'a') as a:
-            a.write(json.dumps(attach))
 
-    data = FileContent(file)
-    return data
-
-
-# TODO: Support frame and attach_index
 def pull(stack: str,
          profile: str = "default",
          params: ty.Optional[ty.Dict] = None,
          decoder: ty.Optional[Decoder[ty.Any]] = None,
+         head_ttl: ty.Optional[float] = None,
+         frame: ty.Optional[str] = None,
+         attach_index: ty.Optional[int] = None,
          **kwargs) -> ty.Any:
-    return _pull(create_context(stack, profile), params, decoder, **kwargs)
+    return _pull(create_context(stack, profile), params, decoder, head_ttl, frame, attach_index, **kwargs)
 
 
 def _pull(context: Context,
           params: ty.Optional[ty.Dict] = None,
           decoder: ty.Optional[Decoder[ty.Any]] = None,
+          head_ttl: ty.Optional[float] = None,
+          frame: ty.Optional[str] = None,
+          attach_index: ty.Optional[int] = None,
           **kwargs) -> ty.Any:
     decoder = decoder or AutoHandler()
     decoder.set_context(context)
-    return decoder.decode(pull_data(context, params, **kwargs))
+    head = frame is None
+    frame, index, attach = _pull_attach(context, merge_or_none(params, kwargs), head_ttl, frame, attach_index)
+
+    objects = get_object_cache()
+    key = (context.stack_path(), frame, index, type(decoder))
+    found, obj = objects.get(key)
+    if found:
+        return obj
+
+    data = _frame_data(context, frame, index, attach, head=head)
+
+    if isinstance(data.data, FileContent):
+        with get_cache_manager().pin(data.data.filename):
+            obj = decoder.decode(data)
+    else:
+        obj = decoder.decode(data)
+
+    return objects.put(key, obj, attach.get("length"))
+
+
+def warm(stacks: ty.List[str],
+         params: ty.Optional[ty.List[ty.Dict]] = None,
+         profile: str = "default",
+         max_workers: int = 8) -> WarmReport:
+    """Download attachments of stack heads into the local cache in advance, so later pulls don't wait for downloads.
+
+    Args:
+        stacks: Stacks to warm up.
+        params: Parameters of attachments to download, by default all attachments are downloaded.
+        profile: Profile to use.
+        max_workers: Number of concurrent downloads.
+
+    Returns:
+        Numbers of attachments and bytes which were downloaded, time spent and errors.
+    """
+    start = time.time()
+    report = WarmReport()
+    tasks = []
+
+    if len(stacks) == 0:
+        return report
+
+    base = create_context(stacks[0], profile)
+
+    for stack in stacks:
+        context = base.derive(stack)
+        try:
+            head = context.protocol.pull_head(context.stack_path(), context.profile.token)
+        except Exception as e:
+            report.errors.append((stack, None, e))
+            continue
+        for index, attach in enumerate(head["attachments"]):
+            if params is None or any(attach.get("params", {}) == p for p in params):
+                tasks.append((context, head["id"], index))
+
+    def fetch(context: Context, frame: str, index: int) -> ty.Tuple[int, bool]:
+        path = context.stack_path()
+        attach = context.protocol.pull_attach(path, context.profile.token, frame, index)["attachment"]
+        loaded = []
+
+        def load() -> Content:
+            loaded.append(True)
+            return _load_attach(attach, context)
+
+        file = get_cache_manager().get_or_put(path, frame, index, attach, load)
+        return file.stat().st_size, not loaded
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [(task, pool.submit(fetch, *task)) for task in tasks]
+        for (context, _, index), future in futures:
+            try:
+                length, cached = future.result()
+                report.attachments += 1
+                if cached:
+                    report.cached += 1
+                else:
+                    report.bytes += length
+            except Exception as e:
+                report.errors.append((context.stack, index, e))
+
+    report.elapsed = time.time() - start
+    return report
 
 
 def create_context(stack: str, profile: str = "default") -> Context:
@@ -291,38 +539,3 @@ def tab(title: ty.Optional[str] = None) -> DecoratedValue:
 def app(handler: ty.Callable, depends: ty.Optional[ty.Union[str, ty.List[str]]] = None,
         requirements: ty.Optional[str] = None, project: bool = False, **kwargs):
     return Application(handler, depends, requirements, project, **kwargs)
-
-
-def default_hash_func(*args, **kwargs):
-    if len(kwargs) > 0 or len(args) > 0:
-        return args, frozenset(kwargs.items())
-    else:
-        return 0
-
-
-def _hash(obj):
-    return hash(obj)
-
-
-def cache(hash_func=default_hash_func):
-    memo = {}
-
-    def decorator(func):
-        func.__hash_func__ = hash_func
-
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            hash_value = _hash(hash_func(*args, **kwargs))
-
-            try:
-                return memo[(func, hash_value)]
-            except KeyError:
-                rv = func(*args, **kwargs)
-                memo[(func, hash_value)] = rv
-                return rv
-
-        wrapper.__decorated__ = func
-
-        return wrapper
-
-    return decorator
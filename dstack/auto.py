@@ -6,7 +6,7 @@ from dstack.geopandas import GeoDataFrameEncoderFactory, GeoDataFrameDecoderFact
 from dstack.handler import FrameData, Encoder, Decoder, AbstractFactory
 from dstack.matplotlib import MatplotlibEncoderFactory
 from dstack.pandas import DataFrameEncoderFactory, DataFrameDecoderFactory, SeriesDecoderFactory, \
-    GeneralCsvDecoderFactory, SeriesEncoderFactory
+    GeneralCsvDecoderFactory, SeriesEncoderFactory, GeneralBinaryDecoderFactory
 from dstack.plotly import PlotlyEncoderFactory
 from dstack.sklearn import SklearnModelEncoderFactory, SklearnModelDecoderFactory
 from dstack.tensorflow import TensorFlowKerasModelDecoderFactory, TensorFlowKerasModelEncoderFactory
@@ -47,6 +47,7 @@ class AutoHandler(Encoder[Any], Decoder[Any]):
             DataFrameDecoderFactory(),
             SeriesDecoderFactory(),
             GeneralCsvDecoderFactory(),
+            GeneralBinaryDecoderFactory(),
             SklearnModelDecoderFactory(),
             TorchModelDecoderFactory(),
             TensorFlowKerasModelDecoderFactory(),
@@ -0,0 +1,104 @@
+import threading
+import weakref
+from typing import Optional, Dict, Any
+
+BLOCK = "block"
+DROP = "drop"
+
+
+class BudgetExceededError(RuntimeError):
+    def __init__(self, requested: int, limit: int):
+        self.requested = requested
+        self.limit = limit
+
+    def __str__(self):
+        return f"Can't acquire {self.requested} bytes, in-flight bytes budget {self.limit} is exhausted"
+
+
+class ByteBudget(object):
+    """A semaphore on the number of encoded bytes which are kept in memory until they are uploaded.
+    Bytes are acquired on behalf of an owner, e.g. `Content` object, and released by the owner, so the same
+    owner can be released many times by different components, e.g. by protocol after upload and by frame after push.
+    If the owner is garbage collected its bytes are released automatically.
+    """
+
+    def __init__(self, limit: Optional[int] = None, policy: str = BLOCK):
+        """Create a budget.
+
+        Args:
+            limit: Maximum number of in-flight bytes, `None` means there is no limit.
+            policy: What to do if the budget is exhausted: `block` waits until other owners release their bytes,
+                `drop` raises `BudgetExceededError`.
+        """
+        if policy not in [BLOCK, DROP]:
+            raise ValueError(f"policy can be only {BLOCK} or {DROP} but found {policy}")
+        self.limit = limit
+        self.policy = policy
+        self.in_flight = 0
+        self.owners: Dict[int, int] = {}
+        self.condition = threading.Condition()
+
+    def try_acquire(self, n: int, owner: Any) -> bool:
+        """Acquire bytes only if it is possible without waiting.
+
+        Returns:
+            `True` if bytes are acquired.
+        """
+        with self.condition:
+            if not self._fits(n):
+                return False
+            self._acquire(n, owner)
+            return True
+
+    def acquire(self, n: int, owner: Any, timeout: Optional[float] = None):
+        """Acquire bytes according to the policy. A request which is larger than the limit is granted when
+        nothing else is in flight.
+
+        Raises:
+            BudgetExceededError: If the policy is `drop` and the budget is exhausted or if timeout is expired.
+        """
+        with self.condition:
+            if not self._fits(n):
+                if self.policy == DROP or not self.condition.wait_for(lambda: self._fits(n), timeout):
+                    raise BudgetExceededError(n, self.limit)
+            self._acquire(n, owner)
+
+    def release(self, owner: Any):
+        """Release all bytes acquired by the owner. It does nothing if the owner doesn't hold any bytes."""
+        self._release(id(owner))
+
+    def _fits(self, n: int) -> bool:
+        return self.limit is None or self.in_flight == 0 or self.in_flight + n <= self.limit
+
+    def _acquire(self, n: int, owner: Any):
+        key = id(owner)
+        if key not in self.owners:
+            weakref.finalize(owner, self._release, key)
+        self.owners[key] = self.owners.get(key, 0) + n
+        self.in_flight += n
+
+    def _release(self, key: int):
+        with self.condition:
+            n = self.owners.pop(key, 0)
+            if n:
+                self.in_flight -= n
+                self.condition.notify_all()
+
+
+__budget = ByteBudget()
+
+
+def set_budget(limit: Optional[int], policy: str = BLOCK):
+    """Limit the number of encoded bytes which the process keeps in memory awaiting upload.
+
+    Args:
+        limit: Maximum number of in-flight bytes, `None` removes the limit.
+        policy: `block` to make producers wait, `drop` to make them fail with `BudgetExceededError`.
+            Frames never wait, they spill attachments which don't fit to disk.
+    """
+    global __budget
+    __budget = ByteBudget(limit, policy)
+
+
+def get_budget() -> ByteBudget:
+    return __budget
@@ -0,0 +1,743 @@
+import copy
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional, List, Tuple, Iterator, Any, Hashable, Callable
+from uuid import uuid4
+
+from dstack.config import get_config, _get_config_path, ConfigurationError
+from dstack.content import Content
+
+__pinned: Dict[Path, int] = {}
+__pinned_lock = threading.Lock()
+
+__cache_managers: Dict[Tuple, 'CacheManager'] = {}
+__cache_managers_lock = threading.Lock()
+
+
+def _pin(file: Path):
+    with __pinned_lock:
+        __pinned[file] = __pinned.get(file, 0) + 1
+
+
+def _unpin(file: Path):
+    with __pinned_lock:
+        n = __pinned.get(file, 0) - 1
+        if n > 0:
+            __pinned[file] = n
+        else:
+            __pinned.pop(file, None)
+
+
+def _is_pinned(file: Path) -> bool:
+    with __pinned_lock:
+        return file in __pinned
+
+
+class FileLock(object):
+    """Exclusive lock on a file which works across processes and threads, every `acquire`
+    opens the file again, so threads of the same process exclude each other as well."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.file = open(self.path, "a+b")
+        try:
+            if os.name == "nt":
+                import msvcrt
+                while True:
+                    try:
+                        msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        except BaseException:
+            self.file.close()
+            raise
+
+    def release(self):
+        try:
+            if os.name == "nt":
+                import msvcrt
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class CacheIntegrityError(RuntimeError):
+    def __init__(self, stack: str, frame: str, index: int, expected: str, actual: str):
+        self.stack = stack
+        self.frame = frame
+        self.index = index
+        self.expected = expected
+        self.actual = actual
+
+    def __str__(self):
+        return f"Attachment {self.index} of frame {self.frame} of stack {self.stack} has digest {self.actual} " \
+               f"but {self.expected} is expected"
+
+
+class CacheEntry(object):
+    def __init__(self, stack: str, frame: str, index: int, file: Path, size: int, accessed: float,
+                 attach: Optional[Dict] = None, digest: Optional[str] = None):
+        self.stack = stack
+        self.frame = frame
+        self.index = index
+        self.file = file
+        self.size = size
+        self.accessed = accessed
+        self.attach = attach
+        self.digest = digest
+
+
+class StackStats(object):
+    """Cache usage of a stack."""
+
+    def __init__(self, stack: str, files: int = 0, size: int = 0, created: Optional[float] = None,
+                 accessed: Optional[float] = None, hits: int = 0, misses: int = 0):
+        self.stack = stack
+        self.files = files
+        self.size = size
+        self.created = created
+        self.accessed = accessed
+        self.hits = hits
+        self.misses = misses
+
+
+class CacheManager(object):
+    """Local cache of pulled attachments. Attachment data is stored in a content-addressed blob store
+    `blobs/<digest>` where digest is SHA-256 of the data, so the same data pulled from different stacks is stored
+    once. Attachment metadata with digests, access times and heads of stacks are stored in SQLite index `index.db`.
+    The total size of cached blobs is limited, least recently used attachments are evicted first,
+    blobs which are in use (pinned) are never evicted. The digest is computed while the data is written,
+    if the server reports the digest of an attachment the data is validated against it.
+
+    A shared cache directory, e.g. populated by `dstack cache warm` for all users of a host, can be used read-only:
+    attachments found there are used without copying them into the own cache.
+    """
+    DEFAULT_SIZE_LIMIT = 10 * 1024 ** 3
+    INDEX = "index.db"
+    CHUNK_SIZE = 65536
+    VERSION = 2
+    PRUNE_BATCH = 64
+
+    def __init__(self, root: Path, size_limit: Optional[int] = DEFAULT_SIZE_LIMIT, verify: bool = False,
+                 shared: Optional[Path] = None):
+        """Create cache manager.
+
+        Args:
+            root: Cache directory.
+            size_limit: Maximum total size of cached files in bytes, `None` means there is no limit.
+            verify: Hash cached files every time they are used instead of trusting the stored digest,
+                files which don't match are removed and downloaded again.
+            shared: Read-only cache directory which is checked before the own one.
+        """
+        self.root = root
+        self.size_limit = size_limit
+        self.verify = verify
+        self.shared = shared
+        self.local = threading.local()
+        self.init_index()
+
+    def files_dir(self) -> Path:
+        return self.root / "files"
+
+    def blobs_dir(self) -> Path:
+        return self.root / "blobs"
+
+    def init_index(self):
+        index = self.root / self.INDEX
+        if not index.exists():
+            # files cached by previous versions have no index entries, so they are never used
+            shutil.rmtree(self.files_dir(), ignore_errors=True)
+            shutil.rmtree(self.root / "attachs", ignore_errors=True)
+            self.root.mkdir(parents=True, exist_ok=True)
+
+        with self.db() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                self.create_tables(db)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+    def create_tables(self, db: sqlite3.Connection):
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        if version < 1:
+            # files were stored per attachment before blobs, they are downloaded again
+            db.execute("DROP TABLE IF EXISTS attachments")
+            shutil.rmtree(self.files_dir(), ignore_errors=True)
+        db.execute("CREATE TABLE IF NOT EXISTS attachments ("
+                   "stack TEXT NOT NULL, frame TEXT NOT NULL, idx INTEGER NOT NULL, "
+                   "length INTEGER NOT NULL, attach TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL, "
+                   "digest TEXT NOT NULL, PRIMARY KEY (stack, frame, idx))")
+        db.execute("CREATE INDEX IF NOT EXISTS attachments_accessed ON attachments (accessed)")
+        db.execute("CREATE INDEX IF NOT EXISTS attachments_digest ON attachments (digest)")
+        db.execute("CREATE TABLE IF NOT EXISTS heads (stack TEXT PRIMARY KEY, frame TEXT NOT NULL, "
+                   "updated REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS remote_heads (stack TEXT PRIMARY KEY, head TEXT NOT NULL, "
+                   "fetched REAL NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS frames (stack TEXT NOT NULL, frame TEXT NOT NULL, "
+                   "meta TEXT NOT NULL, PRIMARY KEY (stack, frame))")
+        db.execute("CREATE TABLE IF NOT EXISTS stats (stack TEXT PRIMARY KEY, hits INTEGER NOT NULL, "
+                   "misses INTEGER NOT NULL)")
+
+        # sizes and reference counts of blobs and their total size are maintained by triggers,
+        # so the size of the cache is known without scanning attachments
+        db.execute("CREATE TABLE IF NOT EXISTS blobs (digest TEXT PRIMARY KEY, size INTEGER NOT NULL, "
+                   "refs INTEGER NOT NULL)")
+        db.execute("CREATE TABLE IF NOT EXISTS total (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)")
+        db.execute("INSERT OR IGNORE INTO total (id, size) VALUES (0, 0)")
+        if version < 2:
+            db.execute("DELETE FROM blobs")
+            db.execute("INSERT INTO blobs (digest, size, refs) "
+                       "SELECT digest, MAX(length), COUNT(*) FROM attachments GROUP BY digest")
+            db.execute("UPDATE total SET size = (SELECT COALESCE(SUM(size), 0) FROM blobs) WHERE id = 0")
+            db.execute(f"PRAGMA user_version = {self.VERSION}")
+        # the conflict clause of INSERT OR REPLACE into attachments overrides the ones of the trigger,
+        # so blobs are inserted only if they don't exist
+        db.execute("CREATE TRIGGER IF NOT EXISTS attachments_insert AFTER INSERT ON attachments BEGIN "
+                   "UPDATE total SET size = size + NEW.length "
+                   "WHERE id = 0 AND NOT EXISTS (SELECT 1 FROM blobs WHERE digest = NEW.digest); "
+                   "INSERT INTO blobs (digest, size, refs) "
+                   "SELECT NEW.digest, NEW.length, 0 WHERE NOT EXISTS (SELECT 1 FROM blobs WHERE digest = NEW.digest); "
+                   "UPDATE blobs SET refs = refs + 1 WHERE digest = NEW.digest; "
+                   "END")
+        db.execute("CREATE TRIGGER IF NOT EXISTS attachments_delete AFTER DELETE ON attachments BEGIN "
+                   "UPDATE blobs SET refs = refs - 1 WHERE digest = OLD.digest; "
+                   "UPDATE total SET size = size - (SELECT size FROM blobs WHERE digest = OLD.digest) "
+                   "WHERE id = 0 AND (SELECT refs FROM blobs WHERE digest = OLD.digest) = 0; "
+                   "DELETE FROM blobs WHERE digest = OLD.digest AND refs = 0; "
+                   "END")
+
+    @contextmanager
+    def db(self, root: Optional[Path] = None) -> Iterator[sqlite3.Connection]:
+        """Return a connection to the index, every thread reuses its own connection. Connections are
+        in autocommit mode, so they are kept open between uses."""
+        connections = self.local.__dict__.setdefault("connections", {})
+        # connections of a parent process must not be used after fork
+        key = (os.getpid(), root)
+        conn = connections.get(key)
+        if conn is None:
+            if root is None:
+                conn = sqlite3.connect(str(self.root / self.INDEX), timeout=30, isolation_level=None)
+                # replaced attachments fire the delete trigger, so sizes of their blobs are released
+                conn.execute("PRAGMA recursive_triggers = ON")
+            else:
+                conn = sqlite3.connect(f"{(root / self.INDEX).as_uri()}?mode=ro", timeout=30, isolation_level=None,
+                                       uri=True)
+            connections[key] = conn
+        yield conn
+
+    def blob_path(self, digest: str, root: Optional[Path] = None) -> Path:
+        return (root or self.root) / "blobs" / digest[:2] / digest
+
+    def entry_path(self, stack: str, frame: str, index: int) -> Optional[Path]:
+        """Return the blob of cached attachment."""
+        with self.db() as db:
+            row = db.execute("SELECT digest FROM attachments WHERE stack = ? AND frame = ? AND idx = ?",
+                             (stack, frame, index)).fetchone()
+        return self.blob_path(row[0]) if row else None
+
+    def get(self, stack: str, frame: str, index: int, attach: Dict) -> Optional[Path]:
+        """Find cached attachment in the shared cache or in the own cache and mark it as recently used.
+        The stored digest is trusted unless the cache manager is created with `verify`, in which case
+        the file is hashed again and removed if it is corrupted.
+
+        Returns:
+            Cached file or `None` if there is no valid file in the cache.
+        """
+        if self.shared is not None:
+            file = self.find(stack, frame, index, attach, self.shared)
+            if file is not None:
+                return file
+
+        file = self.find(stack, frame, index, attach)
+        if file is None:
+            return None
+        if self.verify and self.hash(file) != file.name:
+            self.remove(stack, frame, index, corrupted=True)
+            return None
+
+        with self.db() as db:
+            db.execute("UPDATE attachments SET accessed = ? WHERE stack = ? AND frame = ? AND idx = ?",
+                       (time.time(), stack, frame, index))
+        return file
+
+    def find(self, stack: str, frame: str, index: int, attach: Dict, root: Optional[Path] = None) -> Optional[Path]:
+        """Find the blob of the attachment in the own cache or in the read-only cache directory `root`."""
+        try:
+            with self.db(root) as db:
+                row = db.execute("SELECT length, digest FROM attachments WHERE stack = ? AND frame = ? AND idx = ?",
+                                 (stack, frame, index)).fetchone()
+        except sqlite3.Error:
+            if root is None:
+                raise
+            return None
+
+        # frames are immutable and blobs are written atomically, so the length is checked only if it is known
+        length = attach.get("length")
+        expected = attach.get("digest")
+        if row is None or (length is not None and row[0] != length) or (expected is not None and row[1] != expected):
+            return None
+        file = self.blob_path(row[1], root)
+        return file if file.exists() else None
+
+    def get_or_put(self, stack: str, frame: str, index: int, attach: Dict, load: Callable[[], Content],
+                   head: bool = True) -> Path:
+        """Find cached attachment or load and store it. Only one process or thread loads the attachment,
+        others wait for the lock and reuse the result.
+
+        Args:
+            load: A function which returns attachment data, e.g. downloads it.
+            head: `True` if the frame is the head of the stack, see `put`.
+
+        Returns:
+            Cached file.
+        """
+        file = self.get(stack, frame, index, attach)
+        if file is None:
+            with self.lock(stack, frame, index):
+                file = self.get(stack, frame, index, attach)
+                if file is None:
+                    self.record(stack, hit=False)
+                    return self.put(stack, frame, index, attach, load(), head)
+        self.record(stack, hit=True)
+        return file
+
+    def record(self, stack: str, hit: bool):
+        """Count a cache hit or miss of the stack."""
+        column = "hits" if hit else "misses"
+        with self.db() as db:
+            db.execute("INSERT OR IGNORE INTO stats (stack, hits, misses) VALUES (?, 0, 0)", (stack,))
+            db.execute(f"UPDATE stats SET {column} = {column} + 1 WHERE stack = ?", (stack,))
+
+    def lock(self, stack: str, frame: str, index: int) -> FileLock:
+        """Return the lock of the cache entry. Lock files are stored apart from data, so they are never removed
+        while someone is waiting for them."""
+        key = hashlib.sha1(f"{stack}/{frame}/{index}".encode("utf-8")).hexdigest()
+        return FileLock(self.root / "locks" / key[:2] / key)
+
+    def put(self, stack: str, frame: str, index: int, attach: Dict, data: Content, head: bool = True) -> Path:
+        """Store attachment data in the cache. If `head` is `True` the frame becomes the head of the stack
+        and the previous head is evicted as stale, frames which are pulled explicitly by id are kept until
+        they are evicted as least recently used files when the cache exceeds the size limit.
+        Data is written into a temporary file which is renamed when it is complete, so readers never see
+        partially written files.
+
+        Returns:
+            Cached file.
+        """
+        tmp = self.blobs_dir() / "tmp" / str(uuid4())
+        tmp.parent.mkdir(parents=True, exist_ok=True)
+
+        try:
+            digest = hashlib.sha256()
+            stream = data.stream()
+            with tmp.open("wb") as f:
+                while True:
+                    chunk = stream.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            expected = attach.get("digest")
+            if expected is not None and digest.hexdigest() != expected:
+                raise CacheIntegrityError(stack, frame, index, expected, digest.hexdigest())
+            file = self.blob_path(digest.hexdigest())
+            file.parent.mkdir(parents=True, exist_ok=True)
+            # the same data may be already stored for another attachment
+            if not file.exists():
+                os.replace(tmp, file)
+        finally:
+            if tmp.exists():
+                os.remove(tmp)
+
+        previous = self.head(stack) if head else None
+        now = time.time()
+        with self.db() as db:
+            db.execute("INSERT OR REPLACE INTO attachments "
+                       "(stack, frame, idx, length, attach, created, accessed, digest) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                       (stack, frame, index, file.stat().st_size,
+                        json.dumps({k: v for k, v in attach.items() if k != "data"}), now, now, file.name))
+            if head:
+                db.execute("INSERT OR REPLACE INTO heads (stack, frame, updated) VALUES (?, ?, ?)",
+                           (stack, frame, now))
+
+        with self.pin(file):
+            if previous is not None and previous != frame:
+                self.evict_frame(stack, previous)
+            self.evict()
+
+        return file
+
+    @contextmanager
+    def pin(self, file: Path) -> Iterator[Path]:
+        """Protect the file from eviction while it is in use."""
+        _pin(file)
+        try:
+            yield file
+        finally:
+            _unpin(file)
+
+    def hash(self, file: Path) -> str:
+        """Compute SHA-256 digest of the file."""
+        digest = hashlib.sha256()
+        with file.open("rb") as f:
+            while True:
+                chunk = f.read(self.CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def validate(self, entry: CacheEntry) -> bool:
+        """Hash the cached file and compare it with the digest stored when the file was written.
+
+        Returns:
+            `True` if the file is intact.
+        """
+        try:
+            return self.hash(entry.file) == entry.digest
+        except FileNotFoundError:
+            return False
+
+    def entries(self, stack: Optional[str] = None, limit: int = -1, offset: int = 0) -> List[CacheEntry]:
+        """Return cached attachments from the least recently used one."""
+        query = "SELECT stack, frame, idx, length, accessed, attach, digest FROM attachments"
+        args = ()
+        if stack is not None:
+            query += " WHERE stack = ?"
+            args = (stack,)
+
+        with self.db() as db:
+            rows = db.execute(query + " ORDER BY accessed LIMIT ? OFFSET ?", args + (limit, offset)).fetchall()
+
+        return [CacheEntry(s, f, i, self.blob_path(digest), length, accessed, json.loads(attach), digest)
+                for s, f, i, length, accessed, attach, digest in rows]
+
+    def stats(self) -> List[StackStats]:
+        """Return the number and size of cached files, the oldest creation time, the latest access time and
+        the number of hits and misses per stack."""
+        result: Dict[str, StackStats] = {}
+        with self.db() as db:
+            for stack, files, size, created, accessed in db.execute(
+                    "SELECT stack, COUNT(*), SUM(length), MIN(created), MAX(accessed) FROM attachments "
+                    "GROUP BY stack"):
+                result[stack] = StackStats(stack, files, size, created, accessed)
+            for stack, hits, misses in db.execute("SELECT stack, hits, misses FROM stats"):
+                stats = result.setdefault(stack, StackStats(stack))
+                stats.hits = hits
+                stats.misses = misses
+        return [result[stack] for stack in sorted(result)]
+
+    def prune(self, size_limit: Optional[int] = None, max_age: Optional[float] = None) -> List[CacheEntry]:
+        """Evict attachments which were not used for `max_age` seconds and then least recently used attachments
+        until the cache fits `size_limit` bytes. Blobs are removed when the last attachment which refers them
+        is evicted.
+
+        Returns:
+            Evicted entries.
+        """
+        evicted = []
+        now = time.time()
+        # pinned attachments are kept, so the next batch starts after them
+        kept = 0
+        while True:
+            entries = self.entries(limit=self.PRUNE_BATCH, offset=kept)
+            for entry in entries:
+                expired = max_age is not None and now - entry.accessed > max_age
+                if not expired and (size_limit is None or self.size() <= size_limit):
+                    return evicted
+                if self.remove(entry.stack, entry.frame, entry.index):
+                    evicted.append(entry)
+                else:
+                    kept += 1
+            if len(entries) < self.PRUNE_BATCH:
+                return evicted
+
+    def validate_all(self, max_workers: int = 8) -> List[CacheEntry]:
+        """Hash all cached files in parallel and remove corrupted ones.
+
+        Returns:
+            Corrupted entries.
+        """
+        entries = self.entries()
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            valid = list(pool.map(self.validate, entries))
+        corrupted = [entry for entry, ok in zip(entries, valid) if not ok]
+        for entry in corrupted:
+            self.remove(entry.stack, entry.frame, entry.index, corrupted=True)
+        return corrupted
+
+    def clear(self) -> int:
+        """Remove all cached files except pinned ones, heads, frame metadata and statistics.
+
+        Returns:
+            Number of removed files.
+        """
+        removed = len(self.prune(size_limit=0))
+        with self.db() as db:
+            for table in ["heads", "remote_heads", "frames", "stats"]:
+                db.execute(f"DELETE FROM {table}")
+        return removed
+
+    def size(self) -> int:
+        with self.db() as db:
+            return db.execute("SELECT size FROM total WHERE id = 0").fetchone()[0]
+
+    def head(self, stack: str) -> Optional[str]:
+        """Return the latest cached frame of the stack."""
+        with self.db() as db:
+            row = db.execute("SELECT frame FROM heads WHERE stack = ?", (stack,)).fetchone()
+        return row[0] if row else None
+
+    def get_attach(self, stack: str, frame: str, index: int) -> Optional[Dict]:
+        """Return metadata of cached attachment."""
+        with self.db() as db:
+            row = db.execute("SELECT attach FROM attachments WHERE stack = ? AND frame = ? AND idx = ?",
+                             (stack, frame, index)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_remote_head(self, stack: str) -> Optional[Tuple[Dict, float]]:
+        """Return the head received from the server and the time it was received."""
+        with self.db() as db:
+            row = db.execute("SELECT head, fetched FROM remote_heads WHERE stack = ?", (stack,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put_remote_head(self, stack: str, head: Dict):
+        with self.db() as db:
+            db.execute("INSERT OR REPLACE INTO remote_heads (stack, head, fetched) VALUES (?, ?, ?)",
+                       (stack, json.dumps(head), time.time()))
+        self.put_frame(stack, head)
+
+    def get_frame(self, stack: str, frame: str) -> Optional[Dict]:
+        """Return metadata of the frame which was pulled before. Frames are immutable, so it never expires."""
+        with self.db() as db:
+            row = db.execute("SELECT meta FROM frames WHERE stack = ? AND frame = ?", (stack, frame)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_frame(self, stack: str, meta: Dict):
+        with self.db() as db:
+            db.execute("INSERT OR REPLACE INTO frames (stack, frame, meta) VALUES (?, ?, ?)",
+                       (stack, meta["id"], json.dumps(meta)))
+
+    def evict(self):
+        """Evict least recently used files until the cache fits the size limit."""
+        if self.size_limit is not None and self.size() > self.size_limit:
+            self.prune(size_limit=self.size_limit)
+
+    def evict_frame(self, stack: str, frame: str):
+        """Evict all cached attachments and metadata of the frame."""
+        with self.db() as db:
+            rows = db.execute("SELECT idx FROM attachments WHERE stack = ? AND frame = ?", (stack, frame)).fetchall()
+            db.execute("DELETE FROM frames WHERE stack = ? AND frame = ?", (stack, frame))
+
+        for index, in rows:
+            self.remove(stack, frame, index)
+
+    def remove(self, stack: str, frame: str, index: int, corrupted: bool = False) -> bool:
+        """Remove cached attachment unless its blob is pinned. The blob is removed if no other attachment
+        refers it or if it is `corrupted`.
+
+        Returns:
+            `True` if the attachment is removed.
+        """
+        file = self.entry_path(stack, frame, index)
+        if file is None:
+            return True
+        if _is_pinned(file):
+            return False
+
+        with self.db() as db:
+            db.execute("DELETE FROM attachments WHERE stack = ? AND frame = ? AND idx = ?", (stack, frame, index))
+            used = db.execute("SELECT 1 FROM attachments WHERE digest = ? LIMIT 1", (file.name,)).fetchone()
+
+        # if another process stores the same blob concurrently, its attachment refers a missing file
+        # and it is downloaded again next time
+        if corrupted or not used:
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+        return True
+
+
+def get_cache_manager() -> CacheManager:
+    """Return cache manager for the cache directory next to configuration file. The size limit is set
+    by `cache.size_limit` configuration property in bytes, `0` means there is no limit. Cached files
+    are hashed on every use if `cache.verify` configuration property is `true`. A read-only shared cache
+    directory is set by `DSTACK_SHARED_CACHE` environment variable or `cache.shared_dir` configuration property."""
+    size_limit = CacheManager.DEFAULT_SIZE_LIMIT
+    verify = False
+    shared = os.environ.get("DSTACK_SHARED_CACHE")
+    try:
+        config = get_config()
+        value = config.get_property("cache.size_limit")
+        if value is not None:
+            size_limit = int(value) or None
+        verify = str(config.get_property("cache.verify")).lower() == "true"
+        shared = shared or config.get_property("cache.shared_dir")
+    except ConfigurationError:
+        pass
+    root = _get_config_path().parent / "cache"
+    shared = Path(shared).expanduser() if shared else None
+    shared = None if shared is not None and shared.resolve() == root.resolve() else shared
+
+    # the index is initialized once per configuration unless the cache directory is removed
+    key = (root, size_limit, verify, shared)
+    with __cache_managers_lock:
+        manager = __cache_managers.get(key)
+        if manager is None or not (root / CacheManager.INDEX).exists():
+            manager = CacheManager(root, size_limit, verify, shared)
+            __cache_managers[key] = manager
+        return manager
+
+
+class WarmReport(object):
+    """Result of cache warm-up."""
+
+    def __init__(self):
+        self.attachments = 0
+        self.cached = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.errors: List[Tuple[str, Optional[int], Exception]] = []
+
+    def __repr__(self) -> str:
+        return f"{self.attachments} attachments, {self.bytes} bytes downloaded, {self.cached} already cached, " \
+               f"{len(self.errors)} errors in {self.elapsed:.1f}s"
+
+
+class ObjectCache(object):
+    """In-memory LRU cache of decoded objects, so pulling the same attachment again in the same process
+    doesn't run the decoder. Keys are `(stack, frame, attachment index, decoder class)`, frames are immutable,
+    so cached objects never become stale.
+    """
+
+    def __init__(self, max_size: int = 0, copy_on_return: bool = True):
+        """Create object cache.
+
+        Args:
+            max_size: Maximum estimated size of cached objects in bytes, `0` disables the cache.
+            copy_on_return: Return a deep copy of the cached object, so callers can't modify cached objects.
+                Objects which can't be copied are not cached.
+        """
+        self.max_size = max_size
+        self.copy_on_return = copy_on_return
+        self.size = 0
+        self.items: OrderedDict = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Find cached object.
+
+        Returns:
+            A pair of flag which is `True` if the object is found and the object itself.
+        """
+        with self.lock:
+            if key not in self.items:
+                return False, None
+            self.items.move_to_end(key)
+            obj, _ = self.items[key]
+        return True, copy.deepcopy(obj) if self.copy_on_return else obj
+
+    def put(self, key: Hashable, obj: Any, size_hint: Optional[int] = None) -> Any:
+        """Cache the object and evict least recently used objects to fit `max_size`.
+
+        Returns:
+            The object to return to the caller, it is a copy if `copy_on_return` is set.
+        """
+        if self.max_size <= 0:
+            return obj
+
+        size = estimate_size(obj, size_hint)
+        if size > self.max_size:
+            return obj
+
+        if self.copy_on_return:
+            try:
+                result = copy.deepcopy(obj)
+            except Exception:
+                return obj
+        else:
+            result = obj
+
+        with self.lock:
+            if key in self.items:
+                self.size -= self.items.pop(key)[1]
+            self.items[key] = (obj, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted) = self.items.popitem(last=False)
+                self.size -= evicted
+
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.size = 0
+
+
+def estimate_size(obj: Any, size_hint: Optional[int] = None) -> int:
+    """Estimate memory used by the object. Pandas, NumPy and PyTorch objects are measured exactly,
+    for other objects the size of encoded data is used if it is known."""
+    if hasattr(obj, "memory_usage") and hasattr(obj, "dtypes"):
+        usage = obj.memory_usage(deep=True)
+        return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+    if hasattr(obj, "nbytes") and isinstance(getattr(obj, "nbytes"), int):
+        return obj.nbytes
+    if hasattr(obj, "element_size") and hasattr(obj, "nelement"):
+        return obj.element_size() * obj.nelement()
+    return size_hint if size_hint is not None else sys.getsizeof(obj)
+
+
+__object_cache = ObjectCache()
+
+
+def set_object_cache(max_size: int, copy_on_return: bool = True):
+    """Enable in-memory cache of pulled objects.
+
+    Args:
+        max_size: Maximum estimated size of cached objects in bytes, `0` disables the cache.
+        copy_on_return: Return copies of cached objects.
+    """
+    global __object_cache
+    __object_cache = ObjectCache(max_size, copy_on_return)
+
+
+def get_object_cache() -> ObjectCache:
+    return __object_cache
@@ -0,0 +1,153 @@
+import json
+import time
+from argparse import Namespace, ArgumentTypeError
+from pathlib import Path
+from typing import Optional
+
+from dstack import warm, get_cache_manager
+from dstack.cli import confirm
+
+SIZE_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+AGE_UNITS = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+def parse_size(value: str) -> int:
+    """Parse the number of bytes with an optional K, M, G or T suffix, e.g. `500M`."""
+    value = value.strip().upper().rstrip("B")
+    unit = value[-1:] if value[-1:] in SIZE_UNITS else ""
+    try:
+        return int(float(value[:len(value) - len(unit)]) * SIZE_UNITS[unit])
+    except ValueError:
+        raise ArgumentTypeError(f"invalid size: {value}")
+
+
+def parse_age(value: str) -> float:
+    """Parse the number of seconds with an optional s, m, h or d suffix, e.g. `7d`."""
+    value = value.strip().lower()
+    unit = value[-1:] if value[-1:] in AGE_UNITS else "s"
+    try:
+        return float(value.rstrip(unit)) * AGE_UNITS[unit]
+    except ValueError:
+        raise ArgumentTypeError(f"invalid age: {value}")
+
+
+def format_size(size: int) -> str:
+    for unit in ["", "K", "M", "G"]:
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = "T"
+    return f"{size:.0f}{unit}" if unit == "" else f"{size:.1f}{unit}"
+
+
+def format_age(timestamp: Optional[float]) -> str:
+    if timestamp is None:
+        return "-"
+    age = time.time() - timestamp
+    for unit in ["d", "h", "m"]:
+        if age >= AGE_UNITS[unit]:
+            return f"{age / AGE_UNITS[unit]:.0f}{unit}"
+    return f"{age:.0f}s"
+
+
+def warm_cache(args: Namespace):
+    params = None
+
+    if args.params_file:
+        params = json.loads(Path(args.params_file).read_text())
+        params = params if isinstance(params, list) else [params]
+
+    report = warm(args.stacks, params, args.profile, args.workers)
+
+    print(f"Downloaded {report.bytes} bytes of {report.attachments - report.cached} attachments "
+          f"({report.cached} already cached) in {report.elapsed:.1f}s")
+
+    for stack, index, error in report.errors:
+        print(f"Failed to warm {stack}" + ("" if index is None else f" attachment {index}") + f": {error}")
+
+    if report.errors:
+        exit(1)
+
+
+def cache_stats(args: Namespace):
+    cache = get_cache_manager()
+    stats = cache.stats()
+    limit = "no limit" if cache.size_limit is None else format_size(cache.size_limit)
+    print(f"Cache: {cache.root}")
+    if cache.shared is not None:
+        print(f"Shared cache: {cache.shared}")
+    print(f"Size: {format_size(sum(s.size for s in stats))} of {limit} in {sum(s.files for s in stats)} files")
+    print(f"Hits: {sum(s.hits for s in stats)}, misses: {sum(s.misses for s in stats)}\n")
+
+    print(f"{'STACK':<40} {'FILES':>6} {'SIZE':>8} {'HITS':>6} {'MISSES':>6} {'AGE':>5} {'USED':>5}")
+    for s in stats:
+        print(f"{s.stack:<40} {s.files:>6} {format_size(s.size):>8} {s.hits:>6} {s.misses:>6} "
+              f"{format_age(s.created):>5} {format_age(s.accessed):>5}")
+
+
+def list_cache(args: Namespace):
+    print(f"{'STACK':<40} {'FRAME':<32} {'INDEX':>5} {'SIZE':>8} {'USED':>5}")
+    for e in get_cache_manager().entries(args.stack):
+        print(f"{e.stack:<40} {e.frame:<32} {e.index:>5} {format_size(e.size):>8} {format_age(e.accessed):>5}")
+
+
+def prune_cache(args: Namespace):
+    if args.size is None and args.older_than is None:
+        print("Specify --size or --older-than")
+        exit(1)
+
+    evicted = get_cache_manager().prune(args.size, args.older_than)
+    print(f"Removed {len(evicted)} files, {format_size(sum(e.size for e in evicted))} freed")
+
+
+def verify_cache(args: Namespace):
+    corrupted = get_cache_manager().validate_all(args.workers)
+    for e in corrupted:
+        print(f"Corrupted {e.stack} frame {e.frame} attachment {e.index}, removed")
+    print(f"Found {len(corrupted)} corrupted files")
+
+    if corrupted:
+        exit(1)
+
+
+def clear_cache(args: Namespace):
+    cache = get_cache_manager()
+    if args.force or confirm(f"Do you want to remove everything from {cache.root}"):
+        print(f"Removed {cache.clear()} files")
+
+
+def register_parsers(main_subparsers):
+    parser = main_subparsers.add_parser("cache", help="manage local cache of pulled data")
+    subparsers = parser.add_subparsers()
+
+    warm_parser = subparsers.add_parser("warm", help="download stacks into the cache in advance")
+    warm_parser.add_argument("stacks", metavar="STACK", help="stack to download", type=str, nargs="+")
+    warm_parser.add_argument("--params-file", help="JSON file with parameters of attachments to download, "
+                                                   "a dictionary or a list of dictionaries", dest="params_file")
+    warm_parser.add_argument("--profile", help="profile to use, 'default' if missing", type=str, default="default")
+    warm_parser.add_argument("--workers", help="number of concurrent downloads", type=int, default=8)
+    warm_parser.set_defaults(func=warm_cache)
+
+    stats_parser = subparsers.add_parser("stats", help="show cache size and hits per stack")
+    stats_parser.set_defaults(func=cache_stats)
+
+    ls_parser = subparsers.add_parser("ls", help="list cached attachments")
+    ls_parser.add_argument("stack", metavar="STACK", help="full stack path, e.g. user/stack, all stacks if missing",
+                           type=str, nargs="?")
+    ls_parser.set_defaults(func=list_cache)
+
+    prune_parser = subparsers.add_parser("prune", help="remove least recently used attachments")
+    prune_parser.add_argument("--size", help="shrink the cache to the size, e.g. 500M or 2G", type=parse_size)
+    prune_parser.add_argument("--older-than", help="remove attachments which weren't used for the time, "
+                                                   "e.g. 12h or 7d", dest="older_than", type=parse_age)
+    prune_parser.set_defaults(func=prune_cache)
+
+    verify_parser = subparsers.add_parser("verify", help="check digests of cached attachments and remove "
+                                                         "corrupted ones")
+    verify_parser.add_argument("--workers", help="number of files to check in parallel", type=int, default=8)
+    verify_parser.set_defaults(func=verify_cache)
+
+    clear_parser = subparsers.add_parser("clear", help="remove everything from the cache")
+    clear_parser.add_argument("--force", help="don't ask for confirmation", action="store_true")
+    clear_parser.set_defaults(func=clear_cache)
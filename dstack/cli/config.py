@@ -37,7 +37,7 @@ def add_or_modify_profile(args: Namespace):
     token = get_or_ask(args, profile, "token", "Token: ", secure=True)
 
     if profile is None:
-        profile = Profile(args.profile, user, token, args.server, not args.no_verify)
+        profile = Profile(args.profile, user, token, args.server, not args.no_verify, args.head_ttl)
     elif args.force or (token != profile.token and confirm(
             f"Do you want to replace token for profile '{args.profile}'")):
         profile.token = token
@@ -45,6 +45,8 @@ def add_or_modify_profile(args: Namespace):
     profile.server = args.server
     profile.user = user
     profile.verify = not args.no_verify
+    if args.head_ttl is not None:
+        profile.head_ttl = args.head_ttl if args.head_ttl >= 0 else None
 
     conf.add_or_replace_profile(profile)
     conf.save()
@@ -59,6 +61,9 @@ def register_parsers(main_subparsers):
         command_parser.add_argument("--user", help="set user name", type=str, nargs="?")
         command_parser.add_argument("--no-verify", help="do not verify SSL certificates", dest="no_verify",
                                     action="store_true")
+        command_parser.add_argument("--head-ttl", help="use pulled stack heads for the given number of seconds "
+                                                       "without asking the server, negative value disables it",
+                                    dest="head_ttl", type=float)
 
     def add_force_argument(command_parser):
         command_parser.add_argument("--force", help="don't ask for confirmation", action="store_true")
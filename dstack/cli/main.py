@@ -1,6 +1,7 @@
 import sys
 from argparse import ArgumentParser
 
+import dstack.cli.cache as cache
 import dstack.cli.config as config
 import dstack.cli.server as server
 from dstack.version import __version__ as version
@@ -13,6 +14,7 @@ def main():
 
     config.register_parsers(subparsers)
     server.register_parsers(subparsers)
+    cache.register_parsers(subparsers)
 
     if len(sys.argv) < 2:
         parser.print_help()
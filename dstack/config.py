@@ -31,9 +31,11 @@ class Profile(object):
          token:  A token of selected profile.
          server: API endpoint.
          verify: Enable SSL certificate verification.
+         head_ttl: Number of seconds pulled stack heads are used without asking the server.
     """
 
-    def __init__(self, name: str, user: str, token: Optional[str], server: str, verify: bool):
+    def __init__(self, name: str, user: str, token: Optional[str], server: str, verify: bool,
+                 head_ttl: Optional[float] = None):
         """Create a profile object.
 
         Args:
@@ -41,12 +43,15 @@ class Profile(object):
             user: Username.
             token: A token which will be used with this profile.
             server: A server which provides API calls.
+            head_ttl: Number of seconds pulled stack heads are used without asking the server, after that
+                the cached head is still used but it is refreshed in background. By default heads are not cached.
         """
         self.name = name
         self.user = user
         self.token = token
         self.server = server
         self.verify = verify
+        self.head_ttl = head_ttl
 
 
 class Config(ABC):
@@ -188,7 +193,8 @@ class YamlConfig(DictionaryBasedConfig):
             return None
         else:
             return Profile(name, profile["user"], profile.get("token", None),
-                           profile.get("server", API_SERVER), profile.get("verify", True))
+                           profile.get("server", API_SERVER), profile.get("verify", True),
+                           profile.get("head_ttl", None))
 
     def add_or_replace_profile(self, profile: Profile):
         """Add or replaces existing profile.
@@ -207,6 +213,8 @@ class YamlConfig(DictionaryBasedConfig):
             update["server"] = profile.server
         if not profile.verify:
             update["verify"] = profile.verify
+        if profile.head_ttl is not None:
+            update["head_ttl"] = profile.head_ttl
         profiles[profile.name] = update
         self.yaml_data["profiles"] = profiles
 
@@ -1,5 +1,7 @@
 import base64
 import io
+import mmap
+import tempfile
 from abc import ABC, abstractmethod
 from pathlib import Path
 from types import TracebackType
@@ -96,6 +98,47 @@ class StreamWithProgress(IO):
         return self.parent.__exit__(t, value, traceback)
 
 
+class LimitedStream(io.RawIOBase):
+    """A read-only stream which returns at most `limit` bytes of the parent stream."""
+
+    def __init__(self, parent: IO, limit: int):
+        super().__init__()
+        self.parent = parent
+        self.remaining = limit
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        n = min(len(b), self.remaining)
+        if n <= 0:
+            return 0
+        chunk = self.parent.read(n)
+        size = len(chunk)
+        b[:size] = chunk
+        self.remaining -= size
+        return size
+
+    def close(self) -> None:
+        if not self.closed:
+            self.parent.close()
+        super().close()
+
+
+def skip(stream: IO, n: int):
+    """Move the stream `n` bytes forward, by seeking if it is possible or by reading otherwise."""
+    if n <= 0:
+        return
+    if stream.seekable():
+        stream.seek(n, io.SEEK_CUR)
+        return
+    while n > 0:
+        chunk = stream.read(min(n, 65536))
+        if not chunk:
+            break
+        n -= len(chunk)
+
+
 class Content(ABC):
     @abstractmethod
     def length(self) -> int:
@@ -104,6 +147,10 @@ class Content(ABC):
     def base64length(self) -> int:
         return (int(4 * self.length() / 3) + 3) & ~3
 
+    def is_replayable(self) -> bool:
+        """Return `True` if `stream` can be called many times, e.g. to retry failed upload."""
+        return True
+
     @abstractmethod
     def stream(self) -> IO:
         pass
@@ -115,6 +162,29 @@ class Content(ABC):
     def base64value(self) -> str:
         return base64.b64encode(self.value()).decode()
 
+    def range(self, offset: int, length: Optional[int] = None) -> 'Content':
+        """Return a view over a part of the content, so only requested bytes will be read.
+
+        Args:
+            offset: The first byte of the view.
+            length: A number of bytes in the view, by default it is the rest of the content.
+
+        Returns:
+            Content which represents requested bytes.
+        """
+        offset, length = self._check_range(offset, length)
+        return RangeContent(self, offset, length)
+
+    def _check_range(self, offset: int, length: Optional[int]) -> (int, int):
+        total = self.length()
+        if offset < 0 or offset > total:
+            raise ValueError(f"Offset {offset} is out of content bounds [0, {total}]")
+        if length is None:
+            length = total - offset
+        if length < 0:
+            raise ValueError(f"Length must be non-negative but found {length}")
+        return offset, min(length, total - offset)
+
     def to_file(self, path: Path, show_progress: bool):
         chunk_size = 4096
         if show_progress:
@@ -143,11 +213,16 @@ class BytesContent(Content):
         return self.buf.getbuffer().nbytes
 
     def stream(self) -> IO:
+        self.buf.seek(0)
         return self.buf
 
     def value(self) -> bytes:
         return self.buf.getvalue()
 
+    def range(self, offset: int, length: Optional[int] = None) -> Content:
+        offset, length = self._check_range(offset, length)
+        return BytesContent(self.buf.getbuffer()[offset:offset + length].tobytes())
+
 
 class AbstractStreamContent(Content, ABC):
     def __init__(self):
@@ -162,17 +237,105 @@ class AbstractStreamContent(Content, ABC):
             return self.cache
 
 
+class ReplayBuffer(object):
+    """Copies everything read from a single-use stream into a spooled temporary file,
+    so the data can be read again without reading the original stream twice."""
+
+    def __init__(self, parent: IO, max_size: int):
+        self.parent = parent
+        self.spool = tempfile.SpooledTemporaryFile(max_size=max_size)
+        self.written = 0
+        self.exhausted = False
+
+    def read_at(self, pos: int, n: int) -> bytes:
+        if pos < self.written:
+            self.spool.seek(pos)
+            return self.spool.read(min(n, self.written - pos))
+
+        while not self.exhausted and pos >= self.written:
+            chunk = self.parent.read(max(n, pos - self.written))
+            if not chunk:
+                self.exhausted = True
+                self.parent.close()
+                break
+            self.spool.seek(self.written)
+            self.spool.write(chunk)
+            self.written += len(chunk)
+
+        if pos >= self.written:
+            return b""
+
+        return self.read_at(pos, n)
+
+    def close(self):
+        if not self.exhausted:
+            self.parent.close()
+        self.spool.close()
+
+
+class ReplayStream(io.RawIOBase):
+    def __init__(self, buffer: ReplayBuffer, length: int):
+        super().__init__()
+        self.buffer = buffer
+        self.length = length
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self.buffer.read_at(self.pos, len(b))
+        size = len(chunk)
+        b[:size] = chunk
+        self.pos += size
+        return size
+
+    def seekable(self) -> bool:
+        return True
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.length
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+    def __len__(self) -> int:
+        return self.length
+
+
 class StreamContent(AbstractStreamContent):
-    def __init__(self, input_stream: IO, content_length: int):
+    SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+    def __init__(self, input_stream: IO, content_length: int, replayable: bool = False):
+        """Create content from a stream which can be read only once.
+
+        Args:
+            input_stream: A stream to read.
+            content_length: A number of bytes in the stream.
+            replayable: Tee the first read into a spooled temporary file, so `stream` can be called many times,
+                e.g. to retry upload, to compute a hash or to cache the data without second download.
+        """
         super().__init__()
         self.input_stream = input_stream
         self.content_length = content_length
+        self.replay_buffer = ReplayBuffer(input_stream, self.SPOOL_MAX_SIZE) if replayable else None
 
     def length(self) -> int:
         return self.content_length
 
+    def is_replayable(self) -> bool:
+        return self.replay_buffer is not None
+
     def stream(self) -> IO:
-        return self.input_stream
+        if self.replay_buffer:
+            return ReplayStream(self.replay_buffer, self.content_length)
+        else:
+            return self.input_stream
 
 
 class FileContent(AbstractStreamContent):
@@ -187,6 +350,38 @@ class FileContent(AbstractStreamContent):
         return self.filename.open("rb")
 
 
+class RangeContent(AbstractStreamContent):
+    """A view over a part of other content. File based content is read by seek or mmap,
+    any other content is read sequentially and bytes before `offset` are skipped."""
+
+    def __init__(self, parent: Content, offset: int, length: int):
+        super().__init__()
+        self.parent = parent
+        self.offset = offset
+        self.content_length = length
+
+    def length(self) -> int:
+        return self.content_length
+
+    def is_replayable(self) -> bool:
+        return self.parent.is_replayable()
+
+    def stream(self) -> IO:
+        s = self.parent.stream()
+        skip(s, self.offset)
+        return LimitedStream(s, self.content_length)
+
+    def value(self) -> bytes:
+        if self.cache is None and isinstance(self.parent, FileContent) and self.content_length > 0:
+            with self.parent.filename.open("rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                self.cache = m[self.offset:self.offset + self.content_length]
+        return super().value()
+
+    def range(self, offset: int, length: Optional[int] = None) -> Content:
+        offset, length = self._check_range(offset, length)
+        return RangeContent(self.parent, self.offset + offset, length)
+
+
 # See https://developer.mozilla.org/en-US/docs/Web/HTTP/Basics_of_HTTP/MIME_types/Common_types
 CONTENT_TYPE_MAP_REVERSED = {
     ".aac": "audio/aac",  # AAC audio
@@ -78,12 +78,15 @@ class Control(ABC, ty.Generic[V]):
     def get_id(self):
         return self._id
 
-    def _update(self):
+    def _apply_pending_view(self):
         if self._pending_view:
             self._apply(self._pending_view)
             self._pending_view = None
             self._dirty = True
 
+    def _update(self):
+        self._apply_pending_view()
+
         if self._handler:
             for p in self._parents:
                 p._update()
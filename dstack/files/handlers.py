@@ -1,7 +1,7 @@
 from pathlib import Path
 from typing import Optional, Dict, Any
 
-from dstack import Encoder, FrameData, StreamContent, MediaType, Decoder
+from dstack import Encoder, FrameData, FileContent, MediaType, Decoder
 from dstack.content import CONTENT_TYPE_MAP_REVERSED
 
 
@@ -11,10 +11,8 @@ class FileEncoder(Encoder[Path]):
         self.settings = settings or {}
 
     def encode(self, obj: Path, description: Optional[str], params: Optional[Dict]) -> FrameData:
-        length = obj.stat().st_size
         media_type = MediaType(CONTENT_TYPE_MAP_REVERSED.get(obj.suffix, "application/octet-stream"))
-        f = obj.open("rb")
-        buf = StreamContent(f, length)
+        buf = FileContent(obj)
         settings = {"filename": obj.name}
         settings.update(self.settings)
         return FrameData(buf, media_type, description, params, settings)
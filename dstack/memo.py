@@ -0,0 +1,476 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from functools import wraps
+from pathlib import Path
+from typing import Optional, Callable, Any, Hashable, NamedTuple, Dict, Tuple
+from uuid import uuid4
+
+import dstack.logger as log
+from dstack.cache_manager import estimate_size
+from dstack.config import get_config, _get_config_path, ConfigurationError
+
+
+class CacheInfo(NamedTuple):
+    """Statistics of a function decorated by `cache`."""
+    hits: int
+    misses: int
+    maxsize: Optional[int]
+    currsize: int
+    weight: int
+
+
+def default_hash_func(*args, **kwargs):
+    if len(kwargs) > 0 or len(args) > 0:
+        return args, frozenset(kwargs.items())
+    else:
+        return 0
+
+
+def _hash(obj):
+    return hash(obj)
+
+
+def _is_instance(obj: Any, tpe: str) -> bool:
+    """Check the type by its name, so optional libraries are not imported."""
+    return any(f"{c.__module__}.{c.__qualname__}" == tpe for c in type(obj).__mro__)
+
+
+def _blake2b(data) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_pandas(obj) -> Hashable:
+    """Fingerprint DataFrame, Series or Index by values, index, names and dtypes using vectorized
+    `hash_pandas_object`."""
+    import pandas as pd
+    from pandas.util import hash_pandas_object
+
+    try:
+        digest = _blake2b(hash_pandas_object(obj, index=True).values.tobytes())
+    except TypeError:
+        # unhashable values, e.g. lists in object columns
+        digest = _blake2b(pickle.dumps(obj, protocol=4))
+    if hasattr(obj, "columns"):
+        names = tuple(map(str, obj.columns)), tuple(map(str, obj.dtypes))
+    else:
+        names = str(obj.name), str(obj.dtype)
+    # an index has no index of its own
+    index_names = obj.names if isinstance(obj, pd.Index) else obj.index.names
+    return "pandas", type(obj).__name__, obj.shape, names, tuple(map(str, index_names)), digest
+
+
+def hash_numpy(obj) -> Hashable:
+    """Fingerprint NumPy array by its buffer, dtype and shape."""
+    import numpy as np
+
+    if obj.dtype.hasobject:
+        digest = _blake2b(pickle.dumps(obj, protocol=4))
+    else:
+        digest = _blake2b(np.ascontiguousarray(obj))
+    return "numpy", obj.dtype.str, obj.shape, digest
+
+
+def _state(value: Any) -> Hashable:
+    if value is None or isinstance(value, (str, bytes, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return tuple(_state(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _state(v)) for k, v in value.items()))
+    if callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', type(value).__qualname__)}"
+    # e.g. a stream of uploaded file, a new upload is a new object
+    return type(value).__qualname__, id(value)
+
+
+def hash_control(control) -> Hashable:
+    """Fingerprint the control by its own state and the state of the controls it depends on. Unlike
+    `Control.__hash__` it doesn't call `value()`, so handlers are not run. Data of controls with handlers
+    is derived from the controls they depend on, so it is not a part of the fingerprint."""
+    control._apply_pending_view()
+    derived = ["label", "enabled"] + (["data"] if control._handler else [])
+    state = tuple(sorted((k, _state(v)) for k, v in vars(control).items()
+                         if not k.startswith("_") and k not in derived))
+    return "control", type(control).__name__, control.get_id(), state, \
+           tuple(hash_control(p) for p in control._parents)
+
+
+HASHERS = {
+    "pandas": [("pandas.core.frame.DataFrame", hash_pandas), ("pandas.core.series.Series", hash_pandas),
+               ("pandas.core.indexes.base.Index", hash_pandas)],
+    "numpy": [("numpy.ndarray", hash_numpy)],
+    "controls": [("dstack.controls.Control", hash_control)],
+}
+
+
+def hash_content(obj: Any, kinds: Tuple[str, ...] = ("pandas", "numpy", "controls")) -> Optional[Hashable]:
+    """Return a fingerprint of the content of DataFrame, NumPy array or control, or `None` for other objects."""
+    for kind in kinds:
+        for tpe, hasher in HASHERS[kind]:
+            if _is_instance(obj, tpe):
+                return hasher(obj)
+    return None
+
+
+def fingerprint(obj: Any, kinds: Tuple[str, ...] = ("pandas", "numpy", "controls")) -> Hashable:
+    """Replace DataFrames, NumPy arrays and controls in the object with hashable fingerprints of their content."""
+    digest = hash_content(obj, kinds)
+    if digest is not None:
+        return digest
+    if isinstance(obj, (list, tuple)):
+        return type(obj).__name__, tuple(fingerprint(o, kinds) for o in obj)
+    if isinstance(obj, dict):
+        return "dict", frozenset((k, fingerprint(v, kinds)) for k, v in obj.items())
+    return obj
+
+
+def _fingerprint_hash_func(*kinds: str) -> Callable:
+    def hash_func(*args, **kwargs):
+        return default_hash_func(*[fingerprint(a, kinds) for a in args],
+                                 **{k: fingerprint(v, kinds) for k, v in kwargs.items()})
+
+    return hash_func
+
+
+content_hash_func = _fingerprint_hash_func("pandas", "numpy", "controls")
+content_hash_func.__doc__ = """Hash function for `cache` which fingerprints DataFrames, Series, NumPy arrays and
+controls by content, e.g. `@cache(hash_func=content_hash_func)`."""
+pandas_hash_func = _fingerprint_hash_func("pandas")
+numpy_hash_func = _fingerprint_hash_func("numpy")
+control_hash_func = _fingerprint_hash_func("controls")
+
+
+class Memo(object):
+    """Results of a cached function. Least recently used results are evicted when there are more than `maxsize`
+    of them or their total weight exceeds `max_weight`, results which are older than `ttl` seconds are recomputed.
+    It is thread-safe, concurrent calls with the same key wait for a single computation and share its result
+    or its exception, exceptions are not cached.
+    """
+
+    def __init__(self, maxsize: Optional[int] = None, ttl: Optional[float] = None,
+                 max_weight: Optional[int] = None, weigh: Callable[[Any], int] = estimate_size):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_weight = max_weight
+        self.weigh = weigh
+        self.items: OrderedDict = OrderedDict()
+        self.calls: Dict[Hashable, Tuple[Future, Hashable]] = {}
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        # cached functions are pickled with application handlers, cached results stay in this process
+        return {"maxsize": self.maxsize, "ttl": self.ttl, "max_weight": self.max_weight, "weigh": self.weigh}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def begin(self, key: Hashable, owner: Optional[Hashable] = None) -> Tuple[Future, bool]:
+        """Find the result or the computation of the key which is in progress, or start a new computation.
+
+        Args:
+            owner: The thread or the task which calls the function, by default it is the current thread.
+
+        Returns:
+            A future of the result and a flag which is `True` if the caller must compute the result
+            and pass it to `finish` or `fail`.
+        """
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None and (self.ttl is None or time.monotonic() - item[2] <= self.ttl):
+                self.items.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(item[0])
+                return future, False
+
+            self.misses += 1
+            owner = threading.get_ident() if owner is None else owner
+            call = self.calls.get(key)
+            future = Future()
+            if call is None:
+                self.calls[key] = (future, owner)
+            elif call[1] != owner:
+                return call[0], False
+            # a recursive call with the same key computes the result itself instead of waiting for itself
+            return future, True
+
+    def finish(self, key: Hashable, future: Future, value: Any):
+        weight = self.weigh(value) if self.max_weight is not None else 0
+        with self.lock:
+            if self.max_weight is None or weight <= self.max_weight:
+                self.pop(key)
+                self.items[key] = (value, weight, time.monotonic())
+                self.weight += weight
+                while (self.maxsize is not None and len(self.items) > self.maxsize) or \
+                        (self.max_weight is not None and self.weight > self.max_weight):
+                    self.pop(next(iter(self.items)))
+            self._end(key, future)
+        future.set_result(value)
+
+    def fail(self, key: Hashable, future: Future, error: BaseException):
+        with self.lock:
+            self._end(key, future)
+        future.set_exception(error)
+
+    def _end(self, key: Hashable, future: Future):
+        if self.calls.get(key, (None,))[0] is future:
+            del self.calls[key]
+
+    def pop(self, key: Hashable):
+        item = self.items.pop(key, None)
+        if item is not None:
+            self.weight -= item[1]
+
+    def info(self) -> CacheInfo:
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.maxsize, len(self.items), self.weight)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+            self.weight = 0
+            self.hits = 0
+            self.misses = 0
+
+
+def _digest(obj) -> str:
+    """Compute a digest of the key which is the same in all processes, unlike `hash`
+    which is randomized for strings."""
+    if isinstance(obj, (tuple, list)):
+        parts = [type(obj).__name__] + [_digest(o) for o in obj]
+    elif isinstance(obj, (set, frozenset)):
+        parts = ["set"] + sorted(_digest(o) for o in obj)
+    elif isinstance(obj, dict):
+        parts = ["dict"] + sorted(_digest(k) + _digest(v) for k, v in obj.items())
+    else:
+        return hashlib.sha256(pickle.dumps(obj, protocol=4)).hexdigest()
+    return hashlib.sha256("/".join(parts).encode("utf-8")).hexdigest()
+
+
+def _current_task() -> Optional[asyncio.Task]:
+    # asyncio.current_task appeared in Python 3.7
+    return asyncio.current_task() if hasattr(asyncio, "current_task") else asyncio.Task.current_task()
+
+
+def _function_key(func) -> str:
+    try:
+        source = inspect.getsource(func).encode("utf-8")
+    except (OSError, TypeError):
+        source = func.__code__.co_code
+    name = f"{func.__module__}.{func.__qualname__}".encode("utf-8")
+    return hashlib.sha256(name + b"\0" + source).hexdigest()[:32]
+
+
+class DiskMemo(object):
+    """Results of a cached function which are pickled into files `<root>/<function>/<arguments>`, so they
+    are shared by processes. The function key includes its source, so results are recomputed when the code changes.
+    The total size of files in `root` is limited, least recently used files are removed first. The directory
+    is scanned only when the size of files written since the last scan may exceed the limit.
+    """
+
+    def __init__(self, root: Path, func: Callable, size_limit: Optional[int] = None, ttl: Optional[float] = None):
+        self.root = root
+        self.dir = root / _function_key(func)
+        self.size_limit = size_limit
+        self.ttl = ttl
+        self.usage: Optional[int] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # other processes write to the same directory, so it is scanned again
+        state["usage"] = None
+        return state
+
+    def get(self, key: str) -> (bool, Any):
+        file = self.dir / key
+        try:
+            with file.open("rb") as f:
+                created, value = pickle.load(f)
+            if self.ttl is not None and time.time() - created > self.ttl:
+                return False, None
+            os.utime(file)
+            return True, value
+        except Exception:
+            # missing, partially evicted or unpicklable results are computed again
+            return False, None
+
+    def put(self, key: str, value: Any):
+        try:
+            data = pickle.dumps((time.time(), value), protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return
+        if self.size_limit is not None and len(data) > self.size_limit:
+            return
+
+        tmp = self.dir / f".{key}.{uuid4()}.tmp"
+        try:
+            self.dir.mkdir(parents=True, exist_ok=True)
+            try:
+                tmp.write_bytes(data)
+                os.replace(tmp, self.dir / key)
+            finally:
+                if tmp.exists():
+                    os.remove(tmp)
+
+            if self.usage is not None:
+                self.usage += len(data)
+            if self.usage is None or self.size_limit is not None and self.usage > self.size_limit:
+                self.evict()
+        except OSError as e:
+            # the result is computed anyway, it is just not persisted, e.g. if the disk is full
+            log.debug(file=str(self.dir / key), error=str(e))
+
+    def evict(self):
+        if self.size_limit is None:
+            return
+        files = []
+        for file in self.root.glob("*/*"):
+            if file.name.endswith(".tmp"):
+                # results which are being written by other threads or processes
+                continue
+            try:
+                stat = file.stat()
+                files.append((stat.st_mtime, stat.st_size, file))
+            except FileNotFoundError:
+                pass
+        total = sum(size for _, size, _ in files)
+        for _, size, file in sorted(files):
+            if total <= self.size_limit:
+                break
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+            total -= size
+        self.usage = total
+
+    def clear(self):
+        for file in self.dir.glob("*"):
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+
+
+DEFAULT_DISK_SIZE_LIMIT = 1024 ** 3
+
+
+def get_memo_dir() -> Path:
+    """Return the directory of persistent results next to configuration file."""
+    return _get_config_path().parent / "memo"
+
+
+def _disk_size_limit() -> Optional[int]:
+    try:
+        value = get_config().get_property("memo.size_limit")
+        if value is not None:
+            return int(value) or None
+    except ConfigurationError:
+        pass
+    return DEFAULT_DISK_SIZE_LIMIT
+
+
+def cache(hash_func=default_hash_func, maxsize: Optional[int] = None, ttl: Optional[float] = None,
+          max_weight: Optional[int] = None, weigh: Callable[[Any], int] = estimate_size,
+          persist: bool = False, disk_size_limit: Optional[int] = None):
+    """Memoize results of the function.
+
+    Args:
+        hash_func: A function which computes the key of arguments.
+        maxsize: Maximum number of cached results, by default it is unlimited.
+        ttl: Number of seconds results are valid, by default they never expire.
+        max_weight: Maximum total weight of cached results, e.g. estimated size in bytes,
+            results which are heavier than that are not cached.
+        weigh: A function which computes the weight of a result, by default it estimates memory used by the result.
+        persist: Pickle results to disk, so other processes, e.g. later runs of the application, reuse them.
+            Keys of arguments and results must be picklable.
+        disk_size_limit: Maximum total size of persistent results of all functions in bytes, by default it is set
+            by `memo.size_limit` configuration property or it is 1 GiB.
+
+    Returns:
+        A decorator. Decorated functions have `cache_info()` and `cache_clear()` methods. If the function is
+        a coroutine function, awaited results are cached and concurrent awaiters of the same key share them.
+    """
+
+    def decorator(func):
+        func.__hash_func__ = hash_func
+        memo = Memo(maxsize, ttl, max_weight, weigh)
+        disk = DiskMemo(get_memo_dir(), func, disk_size_limit or _disk_size_limit(), ttl) if persist else None
+
+        def load(key: Hashable) -> Tuple[Optional[str], bool, Any]:
+            if disk is None:
+                return None, False, None
+            try:
+                disk_key = _digest(key)
+            except Exception:
+                # keys which can't be pickled are cached only in memory
+                return None, False, None
+            return (disk_key,) + disk.get(disk_key)
+
+        def store(disk_key: Optional[str], rv: Any):
+            if disk_key is not None:
+                disk.put(disk_key, rv)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                key = hash_func(*args, **kwargs)
+                memo_key = _hash(key)
+
+                future, compute = memo.begin(memo_key, _current_task())
+                if not compute:
+                    return await asyncio.wrap_future(future)
+
+                try:
+                    disk_key, found, rv = load(key)
+                    if not found:
+                        rv = await func(*args, **kwargs)
+                        store(disk_key, rv)
+                except BaseException as e:
+                    memo.fail(memo_key, future, e)
+                    raise
+                memo.finish(memo_key, future, rv)
+                return rv
+        else:
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                key = hash_func(*args, **kwargs)
+                memo_key = _hash(key)
+
+                future, compute = memo.begin(memo_key)
+                if not compute:
+                    return future.result()
+
+                try:
+                    disk_key, found, rv = load(key)
+                    if not found:
+                        rv = func(*args, **kwargs)
+                        store(disk_key, rv)
+                except BaseException as e:
+                    memo.fail(memo_key, future, e)
+                    raise
+                memo.finish(memo_key, future, rv)
+                return rv
+
+        def cache_clear():
+            memo.clear()
+            if disk is not None:
+                disk.clear()
+
+        wrapper.__decorated__ = func
+        wrapper.cache_info = memo.info
+        wrapper.cache_clear = cache_clear
+
+        return wrapper
+
+    return decorator
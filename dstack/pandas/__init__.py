@@ -49,3 +49,12 @@ class GeneralCsvDecoderFactory(DecoderFactory):
     def create(self) -> Decoder:
         from dstack.pandas.handlers import GeneralCsvDecoder
         return GeneralCsvDecoder()
+
+
+class GeneralBinaryDecoderFactory(DecoderFactory):
+    def accept(self, obj: MediaType) -> bool:
+        return self.is_media(obj.content_type, ["application/vnd.apache.parquet", "application/vnd.apache.arrow.file"])
+
+    def create(self) -> Decoder:
+        from dstack.pandas.handlers import GeneralBinaryDecoder
+        return GeneralBinaryDecoder()
@@ -1,25 +1,104 @@
 from abc import ABC, abstractmethod
 from csv import QUOTE_ALL
-from io import StringIO
-from typing import Optional, Dict, TypeVar, List
+from functools import lru_cache
+from io import StringIO, BytesIO
+from typing import Optional, Dict, TypeVar, List, IO, Any
 
-from pandas import __version__ as pandas_version, DataFrame, read_csv, Series
+from pandas import __version__ as pandas_version, DataFrame, read_csv, read_parquet, Series, Index, MultiIndex
 from pandas.core.generic import NDFrame
 
+import dstack.logger as log
 from dstack.content import BytesContent, MediaType
 from dstack.handler import Encoder, Decoder
 from dstack.stack import FrameData
 
+CSV = "csv"
+PARQUET = "parquet"
+ARROW = "arrow"
+
+CONTENT_TYPES = {CSV: "text/csv", PARQUET: "application/vnd.apache.parquet",
+                 ARROW: "application/vnd.apache.arrow.file"}
+
+BINARY_THRESHOLD = 16 * 1024 * 1024
+"""Objects which use more memory are encoded in Parquet if pyarrow is installed."""
+
+
+@lru_cache(maxsize=None)
+def has_pyarrow() -> bool:
+    # pyarrow may be installed but fail to import, e.g. if it is built against another version of NumPy
+    try:
+        import pyarrow
+        return True
+    except ImportError:
+        return False
+
+
+def json_name(name: Any) -> Any:
+    if isinstance(name, tuple):
+        return [json_name(n) for n in name]
+    return name if name is None or isinstance(name, (str, int, float, bool)) else str(name)
+
+
+def format_of(media_type: MediaType, settings: Optional[Dict]) -> str:
+    for fmt, content_type in CONTENT_TYPES.items():
+        if media_type.content_type == content_type:
+            return fmt
+    return (settings or {}).get("format", CSV)
+
+
+def read_binary(stream: IO, fmt: str) -> DataFrame:
+    if fmt == PARQUET:
+        return read_parquet(stream)
+    else:
+        import pyarrow as pa
+        return pa.ipc.open_file(pa.BufferReader(stream.read())).read_pandas()
+
 
 class AbstractDataFrameEncoder(Encoder[NDFrame], ABC):
     def __init__(self, encoding: str = "utf-8", header: bool = True,
-                 index: bool = True):
+                 index: bool = True, format: Optional[str] = None,
+                 binary_threshold: Optional[int] = BINARY_THRESHOLD):
+        """Create an encoder.
+
+        Args:
+            encoding: Encoding of CSV.
+            header: Write column names to CSV.
+            index: Write the index.
+            format: `csv`, `parquet` or `arrow` (Arrow IPC file), by default objects which use more memory
+                than `binary_threshold` are encoded in Parquet if pyarrow is installed and other objects in CSV.
+                Parquet and Arrow keep dtypes natively, they require pyarrow.
+            binary_threshold: Memory usage in bytes above which Parquet is selected by default,
+                `None` disables the automatic selection.
+        """
         super().__init__()
+        if format is not None and format not in CONTENT_TYPES:
+            raise ValueError(f"format can be only {', '.join(CONTENT_TYPES)} but found {format}")
         self.encoding = encoding
         self.header = header
         self.index = index
+        self.format = format
+        self.binary_threshold = binary_threshold
+
+    def select_format(self, obj: NDFrame) -> str:
+        if self.format is not None:
+            return self.format
+        if self.binary_threshold is not None and has_pyarrow():
+            usage = obj.memory_usage(index=self.index)
+            if (usage.sum() if hasattr(usage, "sum") else usage) > self.binary_threshold:
+                return PARQUET
+        return CSV
 
     def encode(self, obj: NDFrame, description: Optional[str], params: Optional[Dict]) -> FrameData:
+        fmt = self.select_format(obj)
+        if fmt != CSV:
+            try:
+                return self.encode_binary(obj, fmt, description, params)
+            except Exception as e:
+                if self.format is not None:
+                    raise
+                # pyarrow can't convert some objects, e.g. columns of mixed types, which CSV can store
+                log.debug(format=fmt, error=str(e))
+
         buf = StringIO()
         obj.to_csv(buf, index=self.index, header=self.header, encoding=self.encoding, quoting=QUOTE_ALL)
         index_type = [str(obj.index.dtype)] if self.index else []
@@ -32,6 +111,44 @@ class AbstractDataFrameEncoder(Encoder[NDFrame], ABC):
                           "encoding": self.encoding,
                           "version": pandas_version})
 
+    def encode_binary(self, obj: NDFrame, fmt: str, description: Optional[str], params: Optional[Dict]) -> FrameData:
+        df = self.to_frame(obj)
+        settings = {}
+        if isinstance(df.columns, MultiIndex) or not df.columns.is_unique or \
+                not all(isinstance(c, str) for c in df.columns):
+            # Parquet requires unique string column names, so columns are named by their positions
+            # and original names are restored by decoders
+            settings["columns"] = [json_name(c) for c in df.columns]
+            settings["column_levels"] = df.columns.nlevels
+            settings["column_names"] = [json_name(n) for n in df.columns.names]
+            df = df.copy(deep=False)
+            df.columns = [str(i) for i in range(len(df.columns))]
+        if self.index and not all(n is None or isinstance(n, str) for n in df.index.names):
+            # Parquet requires string index names too
+            settings["index_names"] = [json_name(n) for n in df.index.names]
+            df = df.copy(deep=False)
+            df.index = df.index.set_names([None] * df.index.nlevels)
+
+        buf = BytesIO()
+        if fmt == PARQUET:
+            df.to_parquet(buf, index=self.index)
+        else:
+            import pyarrow as pa
+            table = pa.Table.from_pandas(df, preserve_index=self.index)
+            with pa.ipc.new_file(buf, table.schema) as writer:
+                writer.write_table(table)
+        index_type = [str(obj.index.dtype)] if self.index else []
+        settings.update({"format": fmt,
+                         "index": self.index,
+                         "schema": index_type + self.schema(obj),
+                         "version": pandas_version})
+
+        return FrameData(BytesContent(buf), MediaType(CONTENT_TYPES[fmt], self.application()),
+                         description, params, settings)
+
+    def to_frame(self, obj: NDFrame) -> DataFrame:
+        return obj
+
     @abstractmethod
     def application(self) -> str:
         pass
@@ -56,12 +173,26 @@ class SeriesEncoder(AbstractDataFrameEncoder):
     def schema(self, obj: NDFrame) -> List[str]:
         return [str(obj.dtypes)]
 
+    def to_frame(self, obj: NDFrame) -> DataFrame:
+        # Parquet and Arrow require string column names
+        return obj.to_frame(name="0" if obj.name is None else str(obj.name))
+
+    def encode_binary(self, obj: NDFrame, fmt: str, description: Optional[str], params: Optional[Dict]) -> FrameData:
+        data = super().encode_binary(obj, fmt, description, params)
+        data.settings["name"] = obj.name if obj.name is None or isinstance(obj.name, (str, int, float)) \
+            else str(obj.name)
+        return data
+
 
 T = TypeVar("T", DataFrame, Series)
 
 
 class AbstractDataFrameDecoder(Decoder[T], ABC):
     def decode(self, data: FrameData) -> T:
+        fmt = format_of(data.media_type(), data.settings)
+        if fmt != CSV:
+            return self.post_process_binary(read_binary(data.data.stream(), fmt), data.settings or {})
+
         index_col = 0 if data.settings.get("index", None) else None
 
         df = read_csv(data.data.stream(),
@@ -79,6 +210,19 @@ class AbstractDataFrameDecoder(Decoder[T], ABC):
     def post_process(self, df: T, settings: Dict) -> T:
         pass
 
+    def post_process_binary(self, df: DataFrame, settings: Dict) -> T:
+        """Dtypes are stored natively in Parquet and Arrow, so only column names which are not strings
+        have to be restored."""
+        if "columns" in settings:
+            columns, names = settings["columns"], settings.get("column_names")
+            if settings.get("column_levels", 1) > 1:
+                df.columns = MultiIndex.from_tuples([tuple(c) for c in columns], names=names)
+            else:
+                df.columns = Index(columns, name=names[0] if names else None)
+        if "index_names" in settings:
+            df.index = df.index.set_names(settings["index_names"])
+        return df
+
 
 class DataFrameDecoder(AbstractDataFrameDecoder[DataFrame]):
     def is_series(self) -> bool:
@@ -111,6 +255,10 @@ class SeriesDecoder(AbstractDataFrameDecoder[Series]):
 
         return s.astype(schema[0])
 
+    def post_process_binary(self, df: DataFrame, settings: Dict) -> Series:
+        df = super().post_process_binary(df, settings)
+        return df.iloc[:, 0].rename(settings.get("name", None))
+
 
 class GeneralCsvDecoder(AbstractDataFrameDecoder[DataFrame]):
     def is_series(self) -> bool:
@@ -118,3 +266,7 @@ class GeneralCsvDecoder(AbstractDataFrameDecoder[DataFrame]):
 
     def post_process(self, df: DataFrame, settings: Dict) -> DataFrame:
         return df
+
+
+class GeneralBinaryDecoder(GeneralCsvDecoder):
+    """Decoder of Parquet and Arrow IPC files which are not pushed as pandas objects."""
@@ -1,12 +1,15 @@
+import io
 import json
+import time
 from abc import ABC, abstractmethod
-from typing import Dict, Optional, IO, Tuple
+from typing import Dict, Optional, IO, Tuple, List, Union
 
 import requests
 
 import dstack.logger as log
+from dstack.budget import get_budget
 from dstack.config import Profile
-from dstack.content import Content
+from dstack.content import Content, AbstractStreamContent, LimitedStream, skip
 
 
 class MatchError(ValueError):
@@ -26,6 +29,15 @@ class StackNotFoundError(ValueError):
 
 
 class Protocol(ABC):
+    """A protocol to communicate with the server. Custom protocols are registered by `setup_protocol`.
+
+    Notes:
+        `pull_head`, `pull_frame` and `pull_attach` are needed only for pulls with `head_ttl`, `frame` or
+        `attach_index` and for cache warm-up, which fetch stack heads, frames and attachments separately.
+        Protocols which don't implement them support everything else and raise `NotImplementedError`
+        on these calls.
+    """
+
     @abstractmethod
     def push(self, stack: str, token: str, data: Dict) -> Dict:
         pass
@@ -34,43 +46,108 @@ class Protocol(ABC):
     def access(self, stack: str, token: str) -> Dict:
         pass
 
+    def push_batch(self, frames: List[Tuple[str, Dict]], token: str) -> List[Union[Dict, Exception]]:
+        """Push many frames using the same token. A failure of one frame doesn't stop pushing the others.
+
+        Args:
+            frames: Pairs of stack path and frame data.
+            token: A token to use.
+
+        Returns:
+            A response or an exception for every frame in the same order.
+        """
+        result = []
+        for stack, data in frames:
+            try:
+                result.append(self.push(stack, token, data))
+            except Exception as e:
+                result.append(e)
+        return result
+
     @abstractmethod
     def pull(self, stack: str, token: Optional[str], params: Optional[Dict]) -> Tuple[str, int, Dict]:
         pass
 
+    def pull_head(self, stack: str, token: Optional[str]) -> Dict:
+        """Fetch the head frame of the stack.
+
+        Returns:
+            The frame with its `id` and `attachments` metadata without data.
+        """
+        raise NotImplementedError()
+
+    def pull_frame(self, stack: str, token: Optional[str], frame: str) -> Dict:
+        """Fetch the frame of the stack by its id.
+
+        Returns:
+            The frame with its `id` and `attachments` metadata without data.
+        """
+        raise NotImplementedError()
+
+    def pull_attach(self, stack: str, token: Optional[str], frame: str, index: int) -> Dict:
+        """Fetch the attachment of the frame.
+
+        Returns:
+            A response with `attachment` which contains either the data or the download URL.
+        """
+        raise NotImplementedError()
+
     @abstractmethod
     def download(self, url) -> (IO, int):
         pass
 
+    def download_range(self, url, offset: int, length: int) -> (IO, int):
+        """Download only a part of the resource. Protocols which are able to request byte ranges
+        should override this method, by default the whole resource is downloaded and bytes before
+        `offset` are skipped.
+        """
+        stream, _ = self.download(url)
+        skip(stream, offset)
+        return LimitedStream(stream, length), length
+
 
 class JsonProtocol(Protocol):
     ENCODING = "utf-8"
     MAX_SIZE = 5_000_000
+    UPLOAD_RETRIES = 3
 
     def __init__(self, url: str, verify: bool):
         self.url = url
         self.verify = verify
+        # keeps connections alive, so many requests to the same server don't pay for connection setup
+        self.session = requests.Session()
 
     def push(self, stack: str, token: str, data: Dict) -> Dict:
         data["stack"] = stack
 
         if self.length(data) < self.MAX_SIZE:
+            content = []
+
             for attach in data.get("attachments", []):
+                content.append(attach["data"])
                 attach["data"] = attach["data"].base64value()
 
             result = self.do_request("/stacks/push", data, token)
+
+            for d in content:
+                get_budget().release(d)
         else:
             content = []
 
-            for attach in data["attachments"]:
+            for attach in data.get("attachments", []):
                 d = attach.pop("data")
                 content.append(d)
                 attach["length"] = d.length()
 
             result = self.do_request("/stacks/push", data, token)
 
-            for attach in result["attachments"]:
-                self.do_upload(attach["upload_url"], content[attach["index"]])
+            # server returns indices of attachments in the whole frame, but a page of attachments
+            # or an auto pushed attachment starts at the frame index
+            offset = data.get("index", 0)
+            for attach in result.get("attachments", []):
+                d = content[attach["index"] - offset]
+                self.do_upload(attach["upload_url"], d)
+                get_budget().release(d)
 
         return result
 
@@ -78,17 +155,20 @@ class JsonProtocol(Protocol):
         return self.do_request("/stacks/access", {"stack": stack}, token)
 
     def pull(self, stack: str, token: Optional[str], params: Optional[Dict]) -> Tuple[str, int, Dict]:
-        empty = params is None
-        params = {} if empty else params
-        url = f"/stacks/{stack}"
-        res = self.do_request(url, None, token=token, method="GET", stack=stack)
-        attachments = res["stack"]["head"]["attachments"]
-        for index, attach in enumerate(attachments):
-            if (len(attachments) == 1 and empty) or set(attach["params"].items()) == set(params.items()):
-                frame = res["stack"]["head"]["id"]
-                attach_url = f"/attachs/{stack}/{frame}/{index}?download=true"
-                return frame, index, self.do_request(attach_url, None, token=token, method="GET")
-        raise MatchError(params)
+        head = self.pull_head(stack, token)
+        index = match(head["attachments"], params)
+        return head["id"], index, self.pull_attach(stack, token, head["id"], index)
+
+    def pull_head(self, stack: str, token: Optional[str]) -> Dict:
+        res = self.do_request(f"/stacks/{stack}", None, token=token, method="GET", stack=stack)
+        return res["stack"]["head"]
+
+    def pull_frame(self, stack: str, token: Optional[str], frame: str) -> Dict:
+        res = self.do_request(f"/frames/{stack}/{frame}", None, token=token, method="GET", stack=stack)
+        return res["frame"]
+
+    def pull_attach(self, stack: str, token: Optional[str], frame: str, index: int) -> Dict:
+        return self.do_request(f"/attachs/{stack}/{frame}/{index}?download=true", None, token=token, method="GET")
 
     def do_request(self, endpoint: str, data: Optional[Dict],
                    token: Optional[str], method: str = "POST", stack: Optional[str] = None) -> Dict:
@@ -101,13 +181,13 @@ class JsonProtocol(Protocol):
         if token is not None:
             headers["Authorization"] = f"Bearer {token}"
         if data is None:
-            response = requests.request(method=method, url=url,
-                                        headers=headers, verify=self.verify)
+            response = self.session.request(method=method, url=url,
+                                            headers=headers, verify=self.verify)
         else:
             data_bytes = json.dumps(data).encode(self.ENCODING)
             headers["Content-Type"] = f"application/json; charset={self.ENCODING}"
-            response = requests.request(method=method, url=url, data=data_bytes,
-                                        headers=headers, verify=self.verify)
+            response = self.session.request(method=method, url=url, data=data_bytes,
+                                            headers=headers, verify=self.verify)
 
         log.debug(event_id=event_id, func=log.erase_token, request_headers=response.request.headers)
         log.debug(event_id=event_id, func=log.ensure_json_serialization, response_headers=response.headers)
@@ -124,22 +204,58 @@ class JsonProtocol(Protocol):
         return response.json()
 
     def download(self, url) -> (IO, int):
-        r = requests.get(url, stream=True, verify=self.verify)
+        r = self.session.get(url, stream=True, verify=self.verify)
 
         log.debug(func=log.ensure_json_serialization, url=url, reponse_headers=r.headers)
 
         return r.raw, int(r.headers['Content-length'])
 
-    def do_upload(self, upload_url: str, data: Content):
-        event_id = log.uuid()
-        log.debug(event_id=event_id, url=upload_url, length=data.length())
+    def download_range(self, url, offset: int, length: int) -> (IO, int):
+        if length == 0:
+            return LimitedStream(io.BytesIO(), 0), 0
 
-        response = requests.put(url=upload_url, data=data.stream(), verify=self.verify)
+        headers = {"Range": f"bytes={offset}-{offset + length - 1}"}
+        r = self.session.get(url, stream=True, verify=self.verify, headers=headers)
 
-        log.debug(event_id=event_id, func=log.ensure_json_serialization, request_headers=response.request.headers)
-        log.debug(event_id=event_id, func=log.ensure_json_serialization, response_headers=response.headers)
+        log.debug(func=log.ensure_json_serialization, url=url, reponse_headers=r.headers)
 
-        response.raise_for_status()
+        r.raise_for_status()
+
+        # server may ignore range header and send the whole resource
+        if r.status_code != 206:
+            skip(r.raw, offset)
+
+        return LimitedStream(r.raw, length), length
+
+    def do_upload(self, upload_url: str, data: Content):
+        attempts = self.UPLOAD_RETRIES if data.is_replayable() else 1
+
+        for attempt in range(1, attempts + 1):
+            event_id = log.uuid()
+            log.debug(event_id=event_id, url=upload_url, length=data.length(), attempt=attempt)
+
+            try:
+                response = self.session.put(url=upload_url, data=data.stream(), verify=self.verify)
+
+                log.debug(event_id=event_id, func=log.ensure_json_serialization,
+                          request_headers=response.request.headers)
+                log.debug(event_id=event_id, func=log.ensure_json_serialization, response_headers=response.headers)
+
+                response.raise_for_status()
+                return
+            except requests.RequestException as e:
+                log.debug(event_id=event_id, error=str(e))
+                if attempt == attempts or not self.is_transient(e):
+                    raise
+                time.sleep(0.5 * 2 ** (attempt - 1))
+
+    @staticmethod
+    def is_transient(error: requests.RequestException) -> bool:
+        """Only connection problems and server errors are worth to retry, client errors like
+        an expired upload URL will fail again."""
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+        return error.response is not None and error.response.status_code >= 500
 
     def length(self, data: Dict) -> int:
         memo = []
@@ -158,6 +274,63 @@ class JsonProtocol(Protocol):
         return length_without_data + attachments_length
 
 
+def match(attachments: List[Dict], params: Optional[Dict]) -> int:
+    """Find the attachment with exactly the same parameters. If parameters are not specified
+    and there is the only attachment it matches.
+
+    Returns:
+        Index of the attachment.
+
+    Raises:
+        MatchError: If there is no such attachment.
+    """
+    empty = params is None
+    params = {} if empty else params
+    for index, attach in enumerate(attachments):
+        if (len(attachments) == 1 and empty) or attach.get("params", {}) == params:
+            return index
+    raise MatchError(params)
+
+
+class RemoteContent(AbstractStreamContent):
+    """Content of an attachment which has not been downloaded yet. Nothing is requested until
+    the content is read, and ranges are fetched by the protocol without downloading whole attachment.
+    """
+
+    def __init__(self, protocol: Protocol, url: str, content_length: Optional[int], offset: Optional[int] = None):
+        """Create remote content.
+
+        Args:
+            protocol: A protocol to download the content.
+            url: Download URL.
+            content_length: Length of the content, if it is unknown it is taken from the download response.
+            offset: Offset of the range in the resource or `None` if it is the whole resource.
+        """
+        super().__init__()
+        self.protocol = protocol
+        self.url = url
+        self.content_length = content_length
+        self.offset = offset
+
+    def length(self) -> int:
+        if self.content_length is None:
+            self.stream().close()
+        return self.content_length
+
+    def stream(self) -> IO:
+        if self.offset is None:
+            stream, length = self.protocol.download(self.url)
+            if self.content_length is None:
+                self.content_length = length
+        else:
+            stream, _ = self.protocol.download_range(self.url, self.offset, self.content_length)
+        return stream
+
+    def range(self, offset: int, length: Optional[int] = None) -> Content:
+        offset, length = self._check_range(offset, length)
+        return RemoteContent(self.protocol, self.url, length, (self.offset or 0) + offset)
+
+
 class ProtocolFactory(ABC):
     @abstractmethod
     def create(self, profile: Profile) -> Protocol:
@@ -1,17 +1,37 @@
+import itertools
+import shutil
+import tempfile
+import threading
 import time
+import weakref
 from abc import ABC, abstractmethod
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, as_completed
+from pathlib import Path
 from platform import uname
 from sys import version as python_version
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Union, Callable, Iterable
 from uuid import uuid4
 
+import cloudpickle
+import tqdm
 from deprecation import deprecated
 
 from dstack import AutoHandler, Context
+from dstack.budget import get_budget, BudgetExceededError, DROP
+from dstack.content import BytesContent, FileContent
 from dstack.handler import FrameData, Encoder
+from dstack.memo import hash_content
 from dstack.version import __version__ as dstack_version
 
 
+class ObjectModifiedError(ValueError):
+    def __init__(self, obj: Any):
+        self.obj = obj
+
+    def __str__(self):
+        return f"Object of {type(self.obj)} was modified after it had been added to the frame"
+
+
 class EncryptionMethod(ABC):
     @abstractmethod
     def encrypt(self, frame: FrameData) -> FrameData:
@@ -59,25 +79,84 @@ class PushResult(object):
         """ % self.url
 
 
+class BatchPushResult(object):
+    """Result of pushing a single stack by `push_batch`. Either `result` or `error` is set."""
+
+    def __init__(self, stack: str, result: Optional[PushResult] = None, error: Optional[Exception] = None):
+        self.stack = stack
+        self.result = result
+        self.error = error
+
+    def is_ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        return f"{self.stack}: {self.result if self.is_ok() else repr(self.error)}"
+
+
+class GridFailure(object):
+    """A combination of parameters `StackFrame.add_grid` failed to evaluate or encode."""
+
+    def __init__(self, params: Dict, error: BaseException):
+        self.params = params
+        self.error = error
+
+    def __repr__(self) -> str:
+        return f"{self.params}: {repr(self.error)}"
+
+
 class FrameMeta(object):
     def __init__(self, data: Optional[Dict] = None, **kwargs):
         self.data = merge_or_none(data, kwargs) or {}
 
 
 class StackFrame(object):
+    PAGE_SIZE = 1000
+
     def __init__(self,
                  context: Context,
                  access: Optional[str],
                  auto_push: bool,
-                 encryption: EncryptionMethod):
+                 encryption: EncryptionMethod,
+                 executor: Optional[Executor] = None,
+                 lazy: bool = False,
+                 memory_limit: Optional[int] = None,
+                 page_size: Optional[int] = None):
+        """Create a stack frame.
+
+        Args:
+            context: Stack context.
+            access: Access level for the stack.
+            auto_push: Push every attachment just after it is added.
+            encryption: Encryption method.
+            executor: Thread or process pool to encode attachments in. If it is specified `add` only submits
+                the object to be encoded and `push` waits for all attachments. It is ignored in auto_push mode.
+            lazy: Don't encode objects in `add`, encode them in `push` instead. An object added with the same
+                non-empty parameters as a previous one replaces it, so it is never encoded. Objects must not be
+                modified between `add` and `push`, if values of a DataFrame, Series or NumPy array or the length
+                of another object are changed `ObjectModifiedError` is raised. Modifications of other objects,
+                e.g. matplotlib figures, are not detected. It is ignored in auto_push mode.
+            memory_limit: Maximum number of bytes of encoded attachments kept in memory. Attachments which don't fit
+                are spilled to a temporary directory of the frame and streamed from there on push.
+            page_size: Maximum number of attachments sent in a single request. A larger frame is pushed in pages,
+                attachments of every page are uploaded as soon as the page is accepted, then the frame is committed
+                by sending the total number of attachments. Default is `PAGE_SIZE`.
+        """
         self.access = access
         self.auto_push = auto_push
         self.context = context
         self.encryption_method = encryption
+        self.executor = executor
+        self.lazy = lazy
+        self.memory_limit = memory_limit
+        self.memory_usage = 0
+        self.page_size = page_size or self.PAGE_SIZE
+        self.spill_dir: Optional[str] = None
+        self.lock = threading.Lock()
         self.id = uuid4().__str__()
         self.index = 0
         self.timestamp = int(round(time.time() * 1000))  # milliseconds
-        self.data: List[FrameData] = []
+        self.data: List[Union[FrameData, Future, DeferredData]] = []
 
     @deprecated(details="Use add instead")
     def commit(self,
@@ -123,12 +202,162 @@ class StackFrame(object):
         encoder = encoder or AutoHandler()
         encoder.set_context(self.context)
         params = merge_or_none(params, kwargs)
-        data = encoder.encode(obj, description, params)
-        encrypted_data = self.encryption_method.encrypt(data)
-        self.data.append(encrypted_data)
+
+        if self.lazy and not self.auto_push:
+            deferred = DeferredData(encoder, obj, description, params)
+            for i, d in enumerate(self.data):
+                if params and isinstance(d, DeferredData) and d.params == params:
+                    self.data[i] = deferred
+                    return
+            self.data.append(deferred)
+            return
+
+        if self.executor and not self.auto_push:
+            self.data.append(self.executor.submit(encode, encoder, self.encryption_method, obj, description, params))
+            return
+
+        self.append(encode(encoder, self.encryption_method, obj, description, params))
+
+    def add_grid(self,
+                 func: Callable[..., Any],
+                 description: Optional[str] = None,
+                 encoder: Optional[Encoder[Any]] = None,
+                 executor: Optional[Executor] = None,
+                 show_progress: bool = True,
+                 **param_values: Iterable) -> List[GridFailure]:
+        """Evaluate the function over the Cartesian product of parameter values and add every result
+        to the frame with its parameters. Evaluation and encoding are done in the executor, by default it is
+        a process pool, so the function is serialized by cloudpickle and may be a lambda or a closure.
+
+        Args:
+            func: A function which takes parameters as keyword arguments and returns an object to add, e.g. plot.
+            description: Description of every object.
+            encoder: Handler to use, by default it is AutoHandler. It must be picklable to be used in process pool.
+            executor: Thread or process pool to use, by default a new process pool is created for the call.
+            show_progress: Show progress bar.
+            **param_values: Values of every parameter, e.g. `phase=[0.1, 0.2], amplitude=[1, 2]`.
+
+        Returns:
+            Combinations which were failed with errors, results of other combinations are added anyway.
+        """
+        names = list(param_values.keys())
+        grid = [dict(zip(names, values)) for values in itertools.product(*param_values.values())]
+
+        encoder = encoder or AutoHandler()
+        encoder.set_context(self.context)
+        payload = cloudpickle.dumps(func)
+
+        pool = executor or ProcessPoolExecutor()
+        progress = tqdm.tqdm(total=len(grid), desc="Evaluating grid", disable=not show_progress)
+        failures = []
+        futures = {}
+
+        try:
+            futures = {pool.submit(evaluate, payload, encoder, self.encryption_method, description, params): i
+                       for i, params in enumerate(grid)}
+            results: List[Optional[FrameData]] = [None] * len(grid)
+            done = [False] * len(grid)
+            added = 0
+
+            for future in as_completed(futures):
+                index = futures[future]
+                error = future.exception()
+
+                if error is None:
+                    results[index] = future.result()
+                else:
+                    failures.append(GridFailure(grid[index], error))
+                    progress.set_postfix(failed=len(failures))
+
+                done[index] = True
+                progress.update(1)
+
+                # keep grid order but add results as soon as all the previous ones are ready
+                while added < len(grid) and done[added]:
+                    if results[added] is not None:
+                        self.append(results[added])
+                        results[added] = None
+                    added += 1
+        except BaseException:
+            # don't evaluate the rest of the grid if the error is going to be raised anyway
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            progress.close()
+            if executor is None:
+                pool.shutdown()
+
+        return failures
+
+    def append(self, data: FrameData):
+        self.data.append(self.track(data))
 
         if self.auto_push:
-            self.push_data(encrypted_data)
+            self.push_data(data)
+
+    def wait(self) -> List[FrameData]:
+        """Encode deferred attachments and wait until all attachments submitted to the executor are encoded.
+
+        Returns:
+            Encoded attachments in the order they were added.
+
+        Raises:
+            ObjectModifiedError: If a deferred object was modified after it had been added.
+            Exception: The first error raised by an encoder.
+        """
+        for i, d in enumerate(self.data):
+            if isinstance(d, DeferredData):
+                self.data[i] = self.executor.submit(d.encode, self.encryption_method) if self.executor \
+                    else self.track(d.encode(self.encryption_method))
+
+        # results are tracked here rather than in done callbacks, because tracking may wait for the budget
+        # and it must not block threads of the executor
+        for i, d in enumerate(self.data):
+            if isinstance(d, Future):
+                self.data[i] = self.track(d.result())
+        return self.data
+
+    def track(self, data: FrameData) -> FrameData:
+        """Account encoded attachment in frame memory usage and in the process-wide in-flight bytes budget.
+        If the attachment doesn't fit into `memory_limit` or into the budget, the attachment is spilled to disk.
+        It never waits for the budget, because the bytes may be held by frames of the same thread which are
+        not pushed yet, e.g. by `push_batch`. If the budget policy is `drop` and the frame holds no bytes itself
+        `BudgetExceededError` is raised instead."""
+        if not isinstance(data.data, BytesContent):
+            return data
+
+        length = data.data.length()
+        budget = get_budget()
+
+        with self.lock:
+            fits = self.memory_limit is None or self.memory_usage + length <= self.memory_limit
+            if fits and budget.try_acquire(length, data.data):
+                self.memory_usage += length
+                return data
+            holds_memory = self.memory_usage > 0
+
+        if fits and not holds_memory and budget.policy == DROP:
+            raise BudgetExceededError(length, budget.limit)
+
+        with self.lock:
+            if self.spill_dir is None:
+                self.spill_dir = tempfile.mkdtemp(prefix="dstack-frame-")
+                weakref.finalize(self, shutil.rmtree, self.spill_dir, True)
+
+        path = Path(self.spill_dir) / str(uuid4())
+        data.data.to_file(path, show_progress=False)
+        data.data = FileContent(path)
+        return data
+
+    def release(self, data: List[FrameData]):
+        """Release in-flight bytes of the attachments which are already sent."""
+        budget = get_budget()
+        with self.lock:
+            for d in data:
+                if isinstance(d, FrameData) and isinstance(d.data, BytesContent):
+                    budget.release(d.data)
+                    self.memory_usage = max(self.memory_usage - d.data.length(), 0)
 
     def push(self, meta: Optional[FrameMeta] = None) -> PushResult:
         """Push all data to server. In the case of auto_push mode it sends only a total number
@@ -139,24 +368,63 @@ class StackFrame(object):
         Returns:
             Stack URL.
         """
+        try:
+            if not self.auto_push and len(self.wait()) > self.page_size:
+                return self.push_pages(meta)
+            return self.send_push(self.build_push(meta))
+        finally:
+            self.release(self.data)
+
+    def push_pages(self, meta: Optional[FrameMeta] = None) -> PushResult:
+        """Push attachments page by page, so neither request nor response contains all attachments at once,
+        and commit the frame afterwards."""
+        data = self.wait()
+
+        for start in range(0, len(data), self.page_size):
+            page = data[start:start + self.page_size]
+            frame = self.new_frame()
+            frame["index"] = start
+            frame["attachments"] = [filter_none(x.__dict__) for x in page]
+            self.send_push(frame)
+            self.release(page)
+
+        frame = self.new_frame()
+
+        if meta:
+            frame["params"] = meta.data
+
+        frame["size"] = len(data)
+        return self.send_push(frame)
+
+    def build_push(self, meta: Optional[FrameMeta] = None) -> Dict:
+        """Build the frame which `push` sends to server.
+
+        Args:
+            meta: A message associated with this revision.
+        Returns:
+            Frame data to be sent by protocol.
+        """
         frame = self.new_frame()
 
         if meta:
             frame["params"] = meta.data
 
         if not self.auto_push:
-            frame["attachments"] = [filter_none(x.__dict__) for x in self.data]
-            return self.send_push(frame)
+            frame["attachments"] = [filter_none(x.__dict__) for x in self.wait()]
         else:
             frame["size"] = self.index
-            return self.send_push(frame)
+
+        return frame
 
     def push_data(self, data: FrameData):
         frame = self.new_frame()
         frame["index"] = self.index
         frame["attachments"] = [filter_none(data.__dict__)]
         self.index += 1
-        self.send_push(frame)
+        try:
+            self.send_push(frame)
+        finally:
+            self.release([data])
 
     def new_frame(self) -> Dict:
         data = {"id": self.id,
@@ -192,6 +460,46 @@ class StackFrame(object):
                 }}
 
 
+class DeferredData(object):
+    """An object added to a lazy frame which will be encoded on push."""
+
+    def __init__(self, encoder: Encoder, obj: Any, description: Optional[str], params: Optional[Dict]):
+        self.encoder = encoder
+        self.obj = obj
+        self.description = description
+        self.params = params
+        self.fingerprint = fingerprint(obj)
+
+    def encode(self, encryption: EncryptionMethod) -> FrameData:
+        if self.fingerprint != fingerprint(self.obj):
+            raise ObjectModifiedError(self.obj)
+        return encode(self.encoder, encryption, self.obj, self.description, self.params)
+
+
+def fingerprint(obj: Any) -> Any:
+    """Return a cheap fingerprint of the object. DataFrames, Series and NumPy arrays are hashed by their values,
+    other objects are fingerprinted by their length, objects without length, e.g. figures, are not checked."""
+    try:
+        digest = hash_content(obj, ("pandas", "numpy"))
+        if digest is not None:
+            return digest
+        return len(obj)
+    except Exception:
+        return None
+
+
+def evaluate(payload: bytes, encoder: Encoder, encryption: EncryptionMethod,
+             description: Optional[str], params: Dict) -> FrameData:
+    func = cloudpickle.loads(payload)
+    obj = func(**params)
+    return encode(encoder, encryption, obj, description, dict(params))
+
+
+def encode(encoder: Encoder, encryption: EncryptionMethod,
+           obj: Any, description: Optional[str], params: Optional[Dict]) -> FrameData:
+    return encryption.encrypt(encoder.encode(obj, description, params))
+
+
 def filter_none(d):
     if isinstance(d, Dict):
         return {k: filter_none(v) for k, v in d.items() if v is not None}
@@ -10,6 +10,7 @@ class TestProtocol(Protocol):
     def __init__(self):
         self.exception = None
         self.data = {}
+        self.frames = {}
         self.token = None
 
     def push(self, stack: str, token: str, data: Dict) -> Dict:
@@ -32,6 +33,22 @@ class TestProtocol(Protocol):
                 attach["data"] = d
                 return frame, index, {"attachment": attach1}
 
+    def pull_head(self, stack: str, token: Optional[str]) -> Dict:
+        data = self.get_data(stack)
+        return {"id": data["id"],
+                "attachments": [{k: v for k, v in a.items() if k != "data"} for a in data["attachments"]]}
+
+    def pull_frame(self, stack: str, token: Optional[str], frame: str) -> Dict:
+        data = self.get_frame(stack, frame)
+        return {"id": data["id"],
+                "attachments": [{k: v for k, v in a.items() if k != "data"} for a in data["attachments"]]}
+
+    def pull_attach(self, stack: str, token: Optional[str], frame: str, index: int) -> Dict:
+        attach = self.get_frame(stack, frame)["attachments"][index]
+        result = {k: copy.deepcopy(v) for k, v in attach.items() if k != "data"}
+        result["data"] = attach["data"].base64value()
+        return {"attachment": result}
+
     def download(self, url):
         raise NotImplementedError()
 
@@ -41,8 +58,16 @@ class TestProtocol(Protocol):
 
         return self.data[stack]
 
+    def get_frame(self, stack: str, frame: str) -> Dict:
+        if (stack, frame) not in self.frames:
+            return self.get_data(stack)
+
+        return self.frames[(stack, frame)]
+
     def handler(self, data: Dict, token: str) -> Dict:
         self.data[data["stack"]] = data
+        if "id" in data:
+            self.frames[(data["stack"], data["id"])] = data
         self.token = token
         stack = data["stack"]
         return {"url": f"https://api.dstack.ai/{stack}"}
@@ -1,8 +1,10 @@
+import unittest
+
 import numpy as np
 import pandas as pd
 
 from dstack import push, pull
-from dstack.pandas.handlers import DataFrameEncoder, SeriesEncoder
+from dstack.pandas.handlers import DataFrameEncoder, SeriesEncoder, has_pyarrow
 from tests import TestBase
 
 
@@ -57,3 +59,76 @@ class TestPandas(TestBase):
         self.assertEqual(s.index.dtype, s1.index.dtype)
         self.assertTrue(s.equals(s1))
 
+    def test_small_frames_are_csv(self):
+        df = pd.DataFrame({"a": [1, 2, 3]})
+        data = DataFrameEncoder().encode(df, None, None)
+        self.assertEqual("text/csv", data.media_type().content_type)
+
+    def test_auto_binary_format(self):
+        df = pd.DataFrame({"a": np.arange(100)})
+        data = DataFrameEncoder(binary_threshold=0).encode(df, None, None)
+        expected = "application/vnd.apache.parquet" if has_pyarrow() else "text/csv"
+        self.assertEqual(expected, data.media_type().content_type)
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_auto_binary_format_fallback(self):
+        df = pd.DataFrame({"a": [1, "x"]})
+        data = DataFrameEncoder(binary_threshold=0).encode(df, None, None)
+        self.assertEqual("text/csv", data.media_type().content_type)
+        self.assertRaises(ValueError, DataFrameEncoder(format="parquet").encode, df, None, None)
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_binary_non_string_index_names(self):
+        df = pd.DataFrame({"a": [1.5, 2.5]}, index=pd.Index([10, 20], name=5))
+        push("test/pandas/binary_index", df, encoder=DataFrameEncoder(binary_threshold=0))
+        df1 = pull("test/pandas/binary_index")
+        self.assertTrue(df.equals(df1))
+        self.assertEqual(5, df1.index.name)
+
+        s = pd.Series([1.5, 2.5], index=pd.MultiIndex.from_tuples([(1, "a"), (2, "b")], names=[0, "y"]))
+        push("test/pandas/binary_index", s, encoder=SeriesEncoder(binary_threshold=0))
+        s1 = pull("test/pandas/binary_index")
+        self.assertTrue(s.equals(s1))
+        self.assertEqual([0, "y"], list(s1.index.names))
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, DataFrameEncoder, format="xlsx")
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_parquet(self):
+        df = pd.DataFrame({"int": pd.array([1, None], dtype="Int64"),
+                           "datetime": [pd.Timestamp("20180310"), pd.Timestamp("20180311")],
+                           "category": pd.Categorical(["a", "b"])},
+                          index=pd.date_range("20130101", periods=2))
+        push("test/pandas/parquet", df, encoder=DataFrameEncoder(format="parquet"))
+        df1 = pull("test/pandas/parquet")
+        self.assertTrue(df.equals(df1))
+        self.assertEqual(list(df.dtypes), list(df1.dtypes))
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_binary_non_string_columns(self):
+        frames = [pd.DataFrame(np.random.rand(4, 3)),
+                  pd.DataFrame([[1, 2]], columns=pd.MultiIndex.from_tuples([("a", 1), ("b", 2)], names=["x", None])),
+                  pd.DataFrame([[1, 2]], columns=["a", "a"])]
+        for fmt in ["parquet", "arrow"]:
+            for df in frames:
+                push("test/pandas/binary_columns", df, encoder=DataFrameEncoder(format=fmt))
+                df1 = pull("test/pandas/binary_columns")
+                self.assertTrue(df.equals(df1))
+                self.assertTrue(df.columns.equals(df1.columns))
+                self.assertEqual(list(df.columns.names), list(df1.columns.names))
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_arrow(self):
+        df = pd.DataFrame({"float": [1.0, 2.0], "string": ["foo", "bar"]})
+        push("test/pandas/arrow", df, encoder=DataFrameEncoder(format="arrow", index=False))
+        df1 = pull("test/pandas/arrow")
+        self.assertTrue(df.equals(df1))
+
+    @unittest.skipUnless(has_pyarrow(), "pyarrow is not installed")
+    def test_series_parquet(self):
+        s = pd.Series([1.5, 2.5, None], name="price")
+        push("test/pandas/series_parquet", s, encoder=SeriesEncoder(format="parquet"))
+        s1 = pull("test/pandas/series_parquet")
+        self.assertTrue(s.equals(s1))
+        self.assertEqual("price", s1.name)
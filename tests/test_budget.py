@@ -0,0 +1,101 @@
+import gc
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+
+import dstack as ds
+from dstack.budget import ByteBudget, BudgetExceededError, set_budget, get_budget, DROP
+from tests import TestBase
+from tests.test_stack import CountingEncoder
+
+
+class Owner(object):
+    pass
+
+
+class TestByteBudget(TestCase):
+    def test_drop(self):
+        budget = ByteBudget(10, DROP)
+        a, b = Owner(), Owner()
+        budget.acquire(8, a)
+        self.assertFalse(budget.try_acquire(5, b))
+        self.assertRaises(BudgetExceededError, budget.acquire, 5, b)
+        budget.release(a)
+        budget.release(a)
+        self.assertEqual(0, budget.in_flight)
+        # a request larger than the limit is granted if nothing is in flight
+        budget.acquire(20, b)
+        self.assertEqual(20, budget.in_flight)
+
+    def test_block(self):
+        budget = ByteBudget(10)
+        a, b = Owner(), Owner()
+        budget.acquire(8, a)
+        threading.Timer(0.1, budget.release, [a]).start()
+        start = time.time()
+        budget.acquire(5, b)
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        self.assertEqual(5, budget.in_flight)
+        self.assertRaises(BudgetExceededError, budget.acquire, 10, a, 0.01)
+
+    def test_release_on_gc(self):
+        budget = ByteBudget(10)
+        a = Owner()
+        budget.acquire(8, a)
+        del a
+        gc.collect()
+        self.assertEqual(0, budget.in_flight)
+
+
+class TestFrameBudget(TestBase):
+    def tearDown(self):
+        set_budget(None)
+
+    def test_frame_spills_when_budget_exhausted(self):
+        set_budget(10)
+        frame = ds.frame(stack="test/budget")
+        frame.add([1, 2], encoder=CountingEncoder())
+        frame.add([3, 4], encoder=CountingEncoder())
+        self.assertEqual(6, get_budget().in_flight)
+        self.assertIsInstance(frame.data[1].data, ds.FileContent)
+        frame.push()
+        self.assertEqual(0, get_budget().in_flight)
+        attachments = self.get_data("test/budget")["attachments"]
+        self.assertEqual([b"[1, 2]", b"[3, 4]"], [a["data"].value() for a in attachments])
+
+    def test_executor_results_are_tracked_on_wait(self):
+        set_budget(100)
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            frame = ds.frame(stack="test/budget", executor=executor)
+            frame.add([1, 2], encoder=CountingEncoder())
+            frame.add([3, 4], encoder=CountingEncoder())
+            frame.wait()
+            self.assertEqual(12, get_budget().in_flight)
+            frame.push()
+        self.assertEqual(0, get_budget().in_flight)
+
+    def test_push_batch_with_exhausted_budget(self):
+        set_budget(10)
+        results = ds.push_batch([{"stack": f"test/budget_{i}", "obj": [i, i], "encoder": CountingEncoder()}
+                                 for i in range(3)], raise_errors=True)
+        self.assertTrue(all(r.is_ok() for r in results))
+        self.assertEqual(0, get_budget().in_flight)
+
+    def test_frames_of_the_same_thread(self):
+        set_budget(10)
+        frames = [ds.frame(stack=f"test/budget_{i}") for i in range(2)]
+        for frame in frames:
+            frame.add([1, 2, 3], encoder=CountingEncoder())
+            frame.add([4, 5, 6], encoder=CountingEncoder())
+        for frame in frames:
+            frame.push()
+        self.assertEqual(0, get_budget().in_flight)
+
+    def test_auto_push_releases_budget(self):
+        set_budget(10)
+        frame = ds.frame(stack="test/budget", auto_push=True)
+        for i in range(5):
+            frame.add([i, i], encoder=CountingEncoder())
+            self.assertEqual(0, get_budget().in_flight)
+        frame.push()
@@ -0,0 +1,321 @@
+import hashlib
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+from uuid import uuid4
+
+import dstack as ds
+from dstack import BytesContent, Decoder, FrameData, push, pull
+from dstack.cache_manager import CacheManager, ObjectCache, set_object_cache, get_cache_manager, \
+    CacheIntegrityError
+from tests import TestBase
+from tests.test_stack import CountingEncoder
+
+
+class TestCacheManager(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.cache = CacheManager(self.root, size_limit=25)
+
+    def tearDown(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def put(self, stack: str, frame: str, index: int, data: bytes) -> Path:
+        return self.cache.put(stack, frame, index, {"length": len(data)}, BytesContent(data))
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get("user/a", "f1", 0, {"length": 10}))
+        file = self.put("user/a", "f1", 0, b"0123456789")
+        self.assertEqual(file, self.cache.get("user/a", "f1", 0, {"length": 10}))
+        self.assertIsNone(self.cache.get("user/a", "f1", 0, {"length": 11}))
+
+    def test_lru_eviction(self):
+        a = self.put("user/a", "f1", 0, b"aaaaaaaaaa")
+        b = self.put("user/b", "f1", 0, b"bbbbbbbbbb")
+        self.set_accessed("user/a", time.time() - 100)
+        self.set_accessed("user/b", time.time() - 50)
+        self.cache.get("user/a", "f1", 0, {"length": 10})
+        c = self.put("user/c", "f1", 0, b"cccccccccc")
+        self.assertTrue(a.exists())
+        self.assertFalse(b.exists())
+        self.assertTrue(c.exists())
+        self.assertEqual(20, self.cache.size())
+        self.assertEqual(["user/a", "user/c"], sorted(e.stack for e in self.cache.entries()))
+
+    def test_pinned_entries_are_not_evicted(self):
+        a = self.put("user/a", "f1", 0, b"aaaaaaaaaa")
+        self.set_accessed("user/a", time.time() - 100)
+        with self.cache.pin(a):
+            self.put("user/b", "f1", 0, b"bbbbbbbbbb")
+            self.put("user/c", "f1", 0, b"cccccccccc")
+        self.assertTrue(a.exists())
+
+    def test_stale_frames_are_evicted(self):
+        old = self.put("user/a", "f1", 0, b"01")
+        nested = self.put("user/a/b", "f1", 0, b"02")
+        new = self.put("user/a", "f2", 0, b"03")
+        self.assertFalse(old.exists())
+        self.assertTrue(nested.exists())
+        self.assertTrue(new.exists())
+        self.assertEqual("f2", self.cache.head("user/a"))
+        self.assertEqual(["f2"], [e.frame for e in self.cache.entries("user/a")])
+
+    def test_concurrent_get_or_put(self):
+        loads = []
+
+        def load():
+            loads.append(1)
+            time.sleep(0.1)
+            return BytesContent(b"0123456789")
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.cache.get_or_put("user/a", "f1", 0, {"length": 10}, load))) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(1, len(loads))
+        self.assertEqual(8, len(results))
+        self.assertEqual(b"0123456789", results[0].read_bytes())
+        self.assertEqual([results[0].name], [p.name for p in results[0].parent.iterdir()])
+        self.assertFalse(any((self.root / "blobs" / "tmp").iterdir()))
+
+    def test_failed_put_leaves_nothing(self):
+        class BrokenContent(BytesContent):
+            def stream(self):
+                raise IOError()
+
+        self.assertRaises(IOError, self.put_content, "user/a", BrokenContent(b"01"))
+        self.assertIsNone(self.cache.get("user/a", "f1", 0, {"length": 2}))
+        self.assertFalse(any((self.root / "blobs" / "tmp").iterdir()))
+
+    def put_content(self, stack, content):
+        self.cache.put(stack, "f1", 0, {"length": content.length()}, content)
+
+    def test_digest(self):
+        data = b"0123456789"
+        digest = hashlib.sha256(data).hexdigest()
+        file = self.cache.put("user/a", "f1", 0, {"length": 10, "digest": digest}, BytesContent(data))
+        self.assertEqual(digest, self.cache.entries()[0].digest)
+
+        file.write_bytes(b"9876543210")
+        self.assertEqual(file, self.cache.get("user/a", "f1", 0, {"length": 10, "digest": digest}))
+        self.assertFalse(self.cache.validate(self.cache.entries()[0]))
+
+        self.cache.verify = True
+        self.assertIsNone(self.cache.get("user/a", "f1", 0, {"length": 10, "digest": digest}))
+        self.assertEqual([], self.cache.entries())
+
+        with self.assertRaises(CacheIntegrityError):
+            self.cache.put("user/a", "f1", 0, {"length": 10, "digest": digest}, BytesContent(b"9876543210"))
+        self.assertEqual([], self.cache.entries())
+        self.assertFalse(any((self.root / "blobs" / "tmp").iterdir()))
+
+    def test_stats_prune_and_clear(self):
+        self.cache.get_or_put("user/a", "f1", 0, {"length": 2}, lambda: BytesContent(b"01"))
+        self.cache.get_or_put("user/a", "f1", 0, {"length": 2}, lambda: BytesContent(b"01"))
+        self.put("user/b", "f1", 0, b"0123")
+        self.put("user/c", "f1", 0, b"012345")
+        self.set_accessed("user/a", time.time() - 100)
+        self.set_accessed("user/b", time.time() - 50)
+
+        stats = self.cache.stats()
+        self.assertEqual(["user/a", "user/b", "user/c"], [s.stack for s in stats])
+        self.assertEqual([(1, 2, 1, 1), (1, 4, 0, 0)], [(s.files, s.size, s.hits, s.misses) for s in stats[:2]])
+
+        self.assertEqual(["user/a"], [e.stack for e in self.cache.prune(max_age=75)])
+        self.assertEqual(["user/b"], [e.stack for e in self.cache.prune(size_limit=6)])
+        self.assertEqual(6, self.cache.size())
+
+        self.entry_path_of("user/c").write_bytes(b"543210")
+        self.assertEqual(["user/c"], [e.stack for e in self.cache.validate_all()])
+        self.assertEqual([], self.cache.entries())
+
+        self.put("user/c", "f1", 0, b"012345")
+        self.assertEqual(1, self.cache.clear())
+        self.assertEqual([], self.cache.stats())
+
+    def entry_path_of(self, stack: str) -> Path:
+        return self.cache.entry_path(stack, "f1", 0)
+
+    def test_same_data_is_stored_once(self):
+        a = self.put("user/a", "f1", 0, b"0123456789")
+        b = self.put("user/b", "f1", 0, b"0123456789")
+        self.assertEqual(a, b)
+        self.assertEqual(10, self.cache.size())
+
+        self.cache.remove("user/a", "f1", 0)
+        self.assertTrue(b.exists())
+        self.cache.remove("user/b", "f1", 0)
+        self.assertFalse(b.exists())
+        self.assertEqual(0, self.cache.size())
+
+    def test_size_is_tracked(self):
+        self.put("user/a", "f1", 0, b"0123456789")
+        self.put("user/b", "f1", 0, b"0123456789")
+        self.put("user/a", "f1", 0, b"01234")
+        self.assertEqual(15, self.cache.size())
+        self.put("user/b", "f1", 0, b"01234")
+        self.assertEqual(5, self.cache.size())
+
+        with self.cache.db() as db:
+            db.execute("PRAGMA user_version = 1")
+            db.execute("UPDATE total SET size = 0")
+        self.assertEqual(5, CacheManager(self.root).size())
+
+    def test_shared_cache(self):
+        shared = CacheManager(Path(tempfile.mkdtemp()))
+        file = shared.put("user/a", "f1", 0, {"length": 2}, BytesContent(b"01"))
+        self.cache.shared = shared.root
+        try:
+            self.assertEqual(file, self.cache.get_or_put("user/a", "f1", 0, {"length": 2}, lambda: None))
+            self.assertEqual([], self.cache.entries())
+            self.assertIsNone(self.cache.get("user/b", "f1", 0, {"length": 2}))
+        finally:
+            shutil.rmtree(shared.root, ignore_errors=True)
+
+    def test_legacy_cache_is_removed(self):
+        root = Path(tempfile.mkdtemp())
+        (root / "files" / "user" / "a" / "f1").mkdir(parents=True)
+        (root / "files" / "user" / "a" / "f1" / "0").write_bytes(b"01")
+        (root / "attachs").mkdir()
+        cache = CacheManager(root)
+        self.assertFalse((root / "files" / "user" / "a").exists())
+        self.assertFalse((root / "attachs").exists())
+        self.assertEqual(0, cache.size())
+
+        (root / "files" / "user" / "a" / "f1").mkdir(parents=True)
+        with cache.db() as db:
+            db.execute("PRAGMA user_version = 0")
+        cache = CacheManager(root)
+        self.assertFalse((root / "files").exists())
+        self.assertEqual([], cache.entries())
+        shutil.rmtree(root)
+
+    def test_connection_per_thread(self):
+        with self.cache.db() as db1, self.cache.db() as db2:
+            self.assertIs(db1, db2)
+        connections = []
+
+        def connect():
+            with self.cache.db() as conn:
+                connections.append(conn)
+
+        thread = threading.Thread(target=connect)
+        thread.start()
+        thread.join()
+        with self.cache.db() as db:
+            self.assertIsNot(db, connections[0])
+
+    def set_accessed(self, stack: str, accessed: float):
+        with self.cache.db() as db:
+            db.execute("UPDATE attachments SET accessed = ? WHERE stack = ?", (accessed, stack))
+
+
+class CountingDecoder(Decoder[list]):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def decode(self, data: FrameData) -> list:
+        self.count += 1
+        return list(data.data.value())
+
+
+class TestObjectCache(TestBase):
+    def tearDown(self):
+        set_object_cache(0)
+
+    def test_lru(self):
+        cache = ObjectCache(max_size=10, copy_on_return=False)
+        cache.put("a", b"x", 6)
+        cache.put("b", b"y", 4)
+        self.assertEqual((True, b"x"), cache.get("a"))
+        cache.put("c", b"z", 4)
+        self.assertEqual((False, None), cache.get("b"))
+        self.assertEqual((True, b"x"), cache.get("a"))
+        self.assertEqual(10, cache.size)
+
+    def test_pull(self):
+        push("test/objects", [1, 2, 3], encoder=CountingEncoder())
+        decoder = CountingDecoder()
+        self.assertEqual(b"[1, 2, 3]", bytes(pull("test/objects", decoder=decoder)))
+        pull("test/objects", decoder=decoder)
+        self.assertEqual(2, decoder.count)
+
+        set_object_cache(1024)
+        obj = pull("test/objects", decoder=decoder)
+        obj.append(4)
+        self.assertEqual(b"[1, 2, 3]", bytes(pull("test/objects", decoder=decoder)))
+        self.assertEqual(3, decoder.count)
+
+        push("test/objects", [4], encoder=CountingEncoder())
+        self.assertEqual(b"[4]", bytes(pull("test/objects", decoder=decoder)))
+        self.assertEqual(4, decoder.count)
+
+
+class TestPull(TestBase):
+    def test_pull_with_head_ttl(self):
+        stack = f"test/head_ttl_{uuid4().hex}"
+        calls = []
+        pull_head, pull_attach = self.protocol.pull_head, self.protocol.pull_attach
+        self.protocol.pull_head = lambda *args: calls.append("head") or pull_head(*args)
+        self.protocol.pull_attach = lambda *args: calls.append("attach") or pull_attach(*args)
+
+        push(stack, [1], encoder=CountingEncoder())
+        self.assertEqual(b"[1]", bytes(pull(stack, decoder=CountingDecoder(), head_ttl=60)))
+        self.assertEqual(["head", "attach"], calls)
+
+        push(stack, [2], encoder=CountingEncoder())
+        self.assertEqual(b"[1]", bytes(pull(stack, decoder=CountingDecoder(), head_ttl=60)))
+        self.assertEqual(["head", "attach"], calls)
+
+        self.assertEqual(b"[1]", bytes(pull(stack, decoder=CountingDecoder(), head_ttl=0)))
+        cache = get_cache_manager()
+        deadline = time.time() + 10
+        while cache.get_remote_head(f"user/{stack}")[0]["id"] != self.get_data(stack)["id"]:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+        self.assertEqual(b"[2]", bytes(pull(stack, decoder=CountingDecoder(), head_ttl=60)))
+        self.assertEqual(["head", "attach", "head", "attach"], calls)
+
+    def test_pull_with_head_ttl_after_eviction(self):
+        stack = f"test/head_ttl_{uuid4().hex}"
+        data = [uuid4().hex]
+        push(stack, data, encoder=CountingEncoder())
+        self.assertEqual(str(data).encode(), bytes(pull(stack, decoder=CountingDecoder(), head_ttl=60)))
+
+        frame = self.get_data(stack)["id"]
+        get_cache_manager().entry_path(f"user/{stack}", frame, 0).unlink()
+        self.assertEqual(str(data).encode(), bytes(pull(stack, decoder=CountingDecoder(), head_ttl=60)))
+
+    def test_cache_manager_is_reused(self):
+        self.assertIs(get_cache_manager(), get_cache_manager())
+
+    def test_pull_frame(self):
+        stack = f"test/frame_{uuid4().hex}"
+        push(stack, [1], encoder=CountingEncoder(), x=1)
+        first = self.get_data(stack)["id"]
+        frame = ds.frame(stack)
+        frame.add([2], encoder=CountingEncoder(), x=1)
+        frame.add([3], encoder=CountingEncoder(), x=2)
+        frame.push()
+
+        self.assertEqual(b"[3]", bytes(pull(stack, decoder=CountingDecoder(), x=2)))
+        self.assertEqual(b"[1]", bytes(pull(stack, decoder=CountingDecoder(), frame=first, x=1)))
+        self.assertEqual(b"[3]", bytes(pull(stack, decoder=CountingDecoder(), attach_index=1)))
+
+        def offline(*args):
+            raise RuntimeError()
+
+        self.protocol.pull = self.protocol.pull_head = offline
+        self.protocol.pull_frame = self.protocol.pull_attach = offline
+        self.assertEqual(b"[1]", bytes(pull(stack, decoder=CountingDecoder(), frame=first, x=1)))
+        self.assertEqual(b"[1]", bytes(pull(stack, decoder=CountingDecoder(), frame=first, attach_index=0)))
+        with self.assertRaises(RuntimeError):
+            pull(stack, decoder=CountingDecoder(), x=2)
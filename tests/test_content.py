@@ -0,0 +1,105 @@
+import io
+import tempfile
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+from unittest import TestCase
+
+from dstack import BytesContent, FileContent, StreamContent, RemoteContent, Protocol
+
+
+class RangeProtocol(Protocol):
+    def __init__(self, data: bytes):
+        self.data = data
+        self.requests = []
+
+    def push(self, stack: str, token: str, data: Dict) -> Dict:
+        raise NotImplementedError()
+
+    def access(self, stack: str, token: str) -> Dict:
+        raise NotImplementedError()
+
+    def pull(self, stack: str, token: Optional[str], params: Optional[Dict]) -> Tuple[str, int, Dict]:
+        raise NotImplementedError()
+
+    def download(self, url):
+        self.requests.append((url, None))
+        return io.BytesIO(self.data), len(self.data)
+
+    def download_range(self, url, offset: int, length: int):
+        self.requests.append((url, (offset, length)))
+        return io.BytesIO(self.data[offset:offset + length]), length
+
+
+class TestContentRange(TestCase):
+    DATA = b"0123456789abcdef"
+
+    def test_bytes_range(self):
+        content = BytesContent(self.DATA)
+        self.assertEqual(b"2345", content.range(2, 4).value())
+        self.assertEqual(b"cdef", content.range(12).value())
+        self.assertEqual(b"ef", content.range(14, 100).value())
+        self.assertRaises(ValueError, content.range, 17)
+
+    def test_file_range(self):
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "data"
+            path.write_bytes(self.DATA)
+            content = FileContent(path)
+            view = content.range(4, 8)
+            self.assertEqual(8, view.length())
+            self.assertEqual(b"456789ab", view.value())
+            with view.stream() as f:
+                self.assertEqual(b"4567", f.read(4))
+                self.assertEqual(b"89ab", f.read())
+            self.assertEqual(b"89", view.range(4, 2).value())
+
+    def test_stream_range(self):
+        content = StreamContent(io.BytesIO(self.DATA), len(self.DATA))
+        self.assertEqual(b"abc", content.range(10, 3).value())
+
+    def test_remote_range(self):
+        protocol = RangeProtocol(self.DATA)
+        content = RemoteContent(protocol, "http://host/file", len(self.DATA))
+        self.assertEqual(b"6789", content.range(6, 4).value())
+        self.assertEqual(b"89", content.range(6, 4).range(2).value())
+        self.assertEqual([("http://host/file", (6, 4)), ("http://host/file", (8, 2))], protocol.requests)
+        self.assertEqual(self.DATA, content.value())
+
+    def test_remote_unknown_length(self):
+        protocol = RangeProtocol(self.DATA)
+        content = RemoteContent(protocol, "http://host/file", None)
+        self.assertEqual(b"cd", content.range(12, 2).value())
+        self.assertEqual(len(self.DATA), content.length())
+        self.assertEqual([("http://host/file", None), ("http://host/file", (12, 2))], protocol.requests)
+
+
+class TestStreamContent(TestCase):
+    DATA = b"hello world" * 1000
+
+    def test_single_use(self):
+        content = StreamContent(io.BytesIO(self.DATA), len(self.DATA))
+        self.assertFalse(content.is_replayable())
+        self.assertFalse(content.range(10, 5).is_replayable())
+        self.assertEqual(self.DATA, content.stream().read())
+        self.assertEqual(b"", content.stream().read())
+
+    def test_replayable(self):
+        source = io.BytesIO(self.DATA)
+        content = StreamContent(source, len(self.DATA), replayable=True)
+        self.assertTrue(content.is_replayable())
+
+        first = content.stream()
+        self.assertEqual(self.DATA[:100], first.read(100))
+        # the second reader doesn't depend on the position of the first one
+        self.assertEqual(self.DATA, content.stream().read())
+        self.assertEqual(self.DATA[100:], first.read())
+        self.assertTrue(source.closed)
+        self.assertTrue(content.range(10, 5).is_replayable())
+
+        with tempfile.TemporaryDirectory() as d:
+            path = Path(d) / "data"
+            content.to_file(path, show_progress=False)
+            self.assertEqual(self.DATA, path.read_bytes())
+
+        self.assertEqual(len(self.DATA), len(content.stream()))
+        self.assertEqual(self.DATA, content.value())
@@ -0,0 +1,311 @@
+import asyncio
+import inspect
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import cloudpickle
+import numpy as np
+import pandas as pd
+
+import dstack as ds
+import dstack.controls as ctrl
+
+
+class TestCache(TestCase):
+    def test_cache(self):
+        calls = []
+
+        @ds.cache()
+        def square(x):
+            calls.append(x)
+            return x * x
+
+        self.assertEqual(4, square(2))
+        self.assertEqual(4, square(2))
+        self.assertEqual(9, square(3))
+        self.assertEqual([2, 3], calls)
+        self.assertEqual(ds.CacheInfo(1, 2, None, 2, 0), square.cache_info())
+
+        square.cache_clear()
+        self.assertEqual(4, square(2))
+        self.assertEqual([2, 3, 2], calls)
+
+    def test_maxsize(self):
+        calls = []
+
+        @ds.cache(maxsize=2)
+        def identity(x):
+            calls.append(x)
+            return x
+
+        identity(1)
+        identity(2)
+        identity(1)
+        identity(3)
+        identity(1)
+        identity(2)
+        self.assertEqual([1, 2, 3, 2], calls)
+        self.assertEqual(2, identity.cache_info().currsize)
+
+    def test_ttl(self):
+        calls = []
+
+        @ds.cache(ttl=0.05)
+        def identity(x):
+            calls.append(x)
+            return x
+
+        identity(1)
+        identity(1)
+        time.sleep(0.1)
+        identity(1)
+        self.assertEqual([1, 1], calls)
+
+    def test_max_weight(self):
+        @ds.cache(max_weight=10, weigh=len)
+        def repeat(s, n):
+            return s * n
+
+        repeat("a", 4)
+        repeat("b", 4)
+        repeat("c", 20)
+        self.assertEqual(8, repeat.cache_info().weight)
+        repeat("d", 4)
+        self.assertEqual(8, repeat.cache_info().weight)
+        self.assertEqual(2, repeat.cache_info().currsize)
+
+    def test_single_flight(self):
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+
+        @ds.cache()
+        def load(x):
+            calls.append(x)
+            started.set()
+            release.wait(5)
+            if x < 0:
+                raise ValueError(x)
+            return [x]
+
+        for x in [1, -1]:
+            results = []
+
+            def call():
+                try:
+                    results.append(load(x))
+                except ValueError as e:
+                    results.append(e)
+
+            started.clear()
+            release.clear()
+            threads = [threading.Thread(target=call) for _ in range(8)]
+            threads[0].start()
+            started.wait(5)
+            for t in threads[1:]:
+                t.start()
+            time.sleep(0.05)
+            release.set()
+            for t in threads:
+                t.join()
+
+            self.assertEqual(8, len(results))
+            self.assertTrue(all(r is results[0] for r in results))
+
+        self.assertEqual([1, -1], calls)
+        release.set()
+        self.assertRaises(ValueError, load, -1)
+        self.assertEqual([1, -1, -1], calls)
+
+    def test_recursion_with_the_same_key(self):
+        calls = []
+
+        @ds.cache()
+        def count(x):
+            calls.append(x)
+            return count(x) + 1 if len(calls) < 3 else 0
+
+        self.assertEqual(2, count(1))
+        self.assertEqual(2, count(1))
+        self.assertEqual(3, len(calls))
+
+    def test_coroutine(self):
+        calls = []
+
+        @ds.cache()
+        async def load(x):
+            calls.append(x)
+            await asyncio.sleep(0.05)
+            if x < 0:
+                raise ValueError(x)
+            return [x]
+
+        async def main():
+            results = await asyncio.gather(*[load(1) for _ in range(5)])
+            self.assertTrue(all(r is results[0] for r in results))
+            self.assertEqual([1], await load(1))
+            errors = await asyncio.gather(*[load(-1) for _ in range(3)], return_exceptions=True)
+            self.assertTrue(all(isinstance(e, ValueError) for e in errors))
+
+        # asyncio.run requires Python 3.7
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(main())
+            self.assertEqual([1], loop.run_until_complete(load(1)))
+        finally:
+            loop.close()
+        self.assertEqual([1, -1], calls)
+
+    def test_pickle_handler(self):
+        @ds.cache(maxsize=4)
+        def load(x):
+            return [x]
+
+        # handlers of applications which are defined in __main__ are pickled with cached functions they call
+        def handler(x):
+            return load(x)
+
+        handler(1)
+        handler = cloudpickle.loads(cloudpickle.dumps(handler))
+        self.assertEqual([2], handler(2))
+        self.assertEqual([2], handler(2))
+        load = inspect.getclosurevars(handler).nonlocals["load"]
+        self.assertEqual(ds.CacheInfo(1, 1, 4, 1, 0), load.cache_info())
+
+
+class TestContentHash(TestCase):
+    def test_pandas_and_numpy(self):
+        calls = []
+
+        @ds.cache(hash_func=ds.content_hash_func)
+        def total(data, scale=1):
+            calls.append(1)
+            return float(np.asarray(data).sum()) * scale
+
+        df = pd.DataFrame({"a": [1, 2], "b": [3.0, 4.0]})
+        self.assertEqual(10, total(df))
+        self.assertEqual(10, total(df.copy()))
+        self.assertEqual(20, total(df, scale=2))
+        self.assertEqual(10, total(df.rename(columns={"b": "c"})))
+        self.assertEqual(10, total(df["a"] + df["b"]))
+        self.assertEqual(4, len(calls))
+
+        index = pd.Index([1, 2, 3], name="x")
+        self.assertEqual(6, total(index))
+        self.assertEqual(6, total(pd.Index([1, 2, 3], name="x")))
+        self.assertEqual(6, total(index.rename("y")))
+        self.assertEqual(6, len(calls))
+
+        a = np.arange(6)
+        self.assertEqual(15, total(a))
+        self.assertEqual(15, total(a.reshape(2, 3)))
+        self.assertEqual(15, total(np.arange(6)))
+        self.assertEqual(15, total(a.astype("float32")))
+        self.assertEqual(9, len(calls))
+
+    def test_controls(self):
+        updates = []
+
+        def update(control, parent):
+            updates.append(parent.value())
+            control.data = [f"{parent.value()}-{i}" for i in range(3)]
+
+        parent = ctrl.ComboBox(["a", "b"])
+        child = ctrl.ComboBox(handler=update, depends=parent)
+        text = ctrl.TextField("x")
+
+        @ds.cache(hash_func=ds.control_hash_func)
+        def load(control, text):
+            return control.value(), text.value()
+
+        key = ds.control_hash_func(child, text)
+        self.assertEqual([], updates)
+        self.assertEqual(("a-0", "x"), load(child, text))
+        self.assertEqual(["a"], updates)
+        self.assertEqual(("a-0", "x"), load(child, text))
+        self.assertEqual(1, load.cache_info().hits)
+
+        text.apply(ctrl.TextFieldView(text.get_id(), "y"))
+        self.assertEqual(("a-0", "y"), load(child, text))
+        parent.apply(ctrl.ComboBoxView(parent.get_id(), selected=1))
+        self.assertNotEqual(key, ds.control_hash_func(child, text))
+        self.assertEqual(["a"], updates)
+
+
+class TestPersistentCache(TestCase):
+    def setUp(self):
+        self.root = Path(tempfile.mkdtemp())
+        self.config = os.environ.get("DSTACK_CONFIG")
+        os.environ["DSTACK_CONFIG"] = str(self.root / "config.yaml")
+
+    def tearDown(self):
+        if self.config is None:
+            del os.environ["DSTACK_CONFIG"]
+        else:
+            os.environ["DSTACK_CONFIG"] = self.config
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def test_persist(self):
+        calls = []
+
+        def make(size_limit=None):
+            # functions with the same name and source share persistent results like in different processes
+            @ds.cache(persist=True, disk_size_limit=size_limit)
+            def load(name, **kwargs):
+                calls.append(name)
+                return {"name": name, **kwargs}
+
+            return load
+
+        self.assertEqual({"name": "a", "x": 1, "y": 2}, make()("a", x=1, y=2))
+        self.assertEqual({"name": "a", "x": 1, "y": 2}, make()("a", y=2, x=1))
+        self.assertEqual(["a"], calls)
+
+        load = make()
+        load.cache_clear()
+        load("a", x=1, y=2)
+        self.assertEqual(["a", "a"], calls)
+
+        [file] = (self.root / "memo").glob("*/*")
+        os.utime(file, (time.time() - 100, time.time() - 100))
+        load = make(size_limit=file.stat().st_size + 10)
+        load("b")
+        self.assertFalse(file.exists())
+        self.assertEqual(1, len(list((self.root / "memo").glob("*/*"))))
+
+    def test_persist_failures(self):
+        calls = []
+
+        @ds.cache(persist=True, disk_size_limit=1024)
+        def load(arg):
+            calls.append(arg)
+            return [1, 2, 3]
+
+        # another process is writing a result
+        tmp = self.root / "memo" / "f" / ".key.tmp"
+        tmp.parent.mkdir(parents=True)
+        tmp.write_bytes(b"0" * 2048)
+
+        self.assertEqual([1, 2, 3], load(threading.Lock()))
+        with patch("dstack.memo.os.replace", side_effect=OSError("No space left on device")):
+            self.assertEqual([1, 2, 3], load("a"))
+        self.assertEqual([1, 2, 3], load("a"))
+        self.assertEqual(2, len(calls))
+        self.assertTrue(tmp.exists())
+
+    def test_pickle_persistent(self):
+        @ds.cache(persist=True)
+        def load(x):
+            return [x]
+
+        load(1)
+        load = cloudpickle.loads(cloudpickle.dumps(load))
+        self.assertEqual([1], load(1))
+        self.assertEqual(ds.CacheInfo(0, 1, None, 1, 0), load.cache_info())
+
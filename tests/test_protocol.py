@@ -2,10 +2,26 @@ import base64
 import copy
 import json
 from unittest import TestCase
+from unittest.mock import patch
+
+import requests
 
 from dstack import JsonProtocol, BytesContent
 
 
+class UploadSession(object):
+    def __init__(self, *status_codes: int):
+        self.status_codes = list(status_codes)
+        self.calls = 0
+
+    def put(self, url, data, verify):
+        self.calls += 1
+        response = requests.Response()
+        response.status_code = self.status_codes.pop(0)
+        response.request = requests.Request("PUT", url).prepare()
+        return response
+
+
 class TestJsonProtocol(TestCase):
     def test_data_base64_length(self):
         def test_b64(s: str):
@@ -43,3 +59,17 @@ class TestJsonProtocol(TestCase):
         }
         protocol = JsonProtocol("http://myhost", True)
         self.assertEqual(protocol.length(data), length(data))
+
+    @patch("dstack.protocol.time.sleep")
+    def test_upload_retries_server_errors(self, _):
+        protocol = JsonProtocol("http://myhost", True)
+        protocol.session = UploadSession(503, 200)
+        protocol.do_upload("http://upload", BytesContent(b"hello"))
+        self.assertEqual(2, protocol.session.calls)
+
+    @patch("dstack.protocol.time.sleep")
+    def test_upload_does_not_retry_client_errors(self, _):
+        protocol = JsonProtocol("http://myhost", True)
+        protocol.session = UploadSession(403, 200)
+        self.assertRaises(requests.HTTPError, protocol.do_upload, "http://upload", BytesContent(b"hello"))
+        self.assertEqual(1, protocol.session.calls)
@@ -1,11 +1,18 @@
+import gc
+import os
+import time
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from sys import version as python_version
+from typing import Optional, Dict
 
 import matplotlib.pyplot as plt
 import numpy as np
+import pandas as pd
 
 import dstack as ds
-from tests import TestBase
+from dstack.protocol import setup_protocol
+from tests import TestBase, TestProtocolFactory
 
 
 class StackFrameTest(TestBase):
@@ -131,6 +138,195 @@ class StackFrameTest(TestBase):
         self.assertEqual("tab", t["type"])
         self.assertEqual("My brand new tab", t["title"])
 
+    def test_parallel_encoding(self):
+        stack = "plots/parallel"
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            frame = ds.frame(stack=stack, executor=executor)
+            for idx in range(8):
+                frame.add(self.get_figure(), f"plot {idx}", params={"index": idx})
+            frame.push()
+
+        attachments = self.get_data(stack)["attachments"]
+        self.assertEqual(8, len(attachments))
+        for idx, att in enumerate(attachments):
+            self.assertEqual(idx, att["params"]["index"])
+            self.assertEqual(f"plot {idx}", att["description"])
+            self.assertEqual("image/svg+xml", att["content_type"])
+
+    def test_parallel_encoding_error(self):
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            frame = ds.frame(stack="plots/parallel", executor=executor)
+            frame.add(object())
+            self.assertRaises(Exception, frame.push)
+
+    def test_lazy_encoding(self):
+        encoder = CountingEncoder()
+        frame = ds.frame(stack="test/lazy", lazy=True)
+        frame.add([1], params={"x": 1}, encoder=encoder)
+        frame.add([2], params={"x": 2}, encoder=encoder)
+        frame.add([3], params={"x": 1}, encoder=encoder)
+        self.assertEqual(0, encoder.count)
+        frame.push()
+        self.assertEqual(2, encoder.count)
+        attachments = self.get_data("test/lazy")["attachments"]
+        self.assertEqual([b"[3]", b"[2]"], [a["data"].value() for a in attachments])
+
+    def test_lazy_encoding_without_params(self):
+        frame = ds.frame(stack="test/lazy", lazy=True)
+        frame.add([1], encoder=CountingEncoder())
+        frame.add(lambda: None, encoder=CountingEncoder())
+        frame.push()
+        self.assertEqual(2, len(self.get_data("test/lazy")["attachments"]))
+
+    def test_lazy_encoding_modified_object(self):
+        obj = [1, 2, 3]
+        frame = ds.frame(stack="test/lazy", lazy=True)
+        frame.add(obj, encoder=CountingEncoder())
+        obj.append(4)
+        self.assertRaises(ds.ObjectModifiedError, frame.push)
+
+    def test_lazy_encoding_modified_values(self):
+        df = pd.DataFrame({"a": [1, 2]})
+        frame = ds.frame(stack="test/lazy", lazy=True)
+        frame.add(df, encoder=CountingEncoder())
+        df.loc[0, "a"] = 100
+        self.assertRaises(ds.ObjectModifiedError, frame.push)
+
+        a = np.arange(4)
+        frame = ds.frame(stack="test/lazy", lazy=True)
+        frame.add(a, encoder=CountingEncoder())
+        a[0] = 100
+        self.assertRaises(ds.ObjectModifiedError, frame.push)
+
+    def test_add_grid(self):
+        frame = ds.frame(stack="test/grid")
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            failures = frame.add_grid(lambda x, y: [x, y] if x != y else None, encoder=CountingEncoder(),
+                                      executor=executor, show_progress=False, x=[1, 2, 3], y=[1, 2])
+        frame.push()
+        attachments = self.get_data("test/grid")["attachments"]
+        self.assertEqual([{"x": 1, "y": 2}, {"x": 2, "y": 1}, {"x": 3, "y": 1}, {"x": 3, "y": 2}],
+                         [a["params"] for a in attachments])
+        self.assertEqual(b"[3, 2]", attachments[3]["data"].value())
+        self.assertEqual([{"x": 1, "y": 1}, {"x": 2, "y": 2}], sorted([f.params for f in failures], key=str))
+
+    def test_add_grid_cancels_on_error(self):
+        frame = ds.frame(stack="test/grid")
+        evaluated.clear()
+
+        def append(data):
+            raise RuntimeError()
+
+        frame.append = append
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            self.assertRaises(RuntimeError, frame.add_grid, evaluate_slowly, encoder=CountingEncoder(),
+                              executor=executor, show_progress=False, x=range(100))
+        self.assertLess(len(evaluated), 100)
+
+    def test_add_grid_in_processes(self):
+        frame = ds.frame(stack="test/grid")
+        offset = 10
+        failures = frame.add_grid(lambda x: [x + offset] if x > 0 else 1 / x, encoder=CountingEncoder(),
+                                  show_progress=False, x=[0, 1, 2])
+        frame.push()
+        attachments = self.get_data("test/grid")["attachments"]
+        self.assertEqual([b"[11]", b"[12]"], [a["data"].value() for a in attachments])
+        self.assertEqual(1, len(failures))
+        self.assertEqual({"x": 0}, failures[0].params)
+        self.assertIsInstance(failures[0].error, ZeroDivisionError)
+
+    def test_memory_limit(self):
+        frame = ds.frame(stack="test/spill", memory_limit=10)
+        frame.add([1, 2], encoder=CountingEncoder())
+        frame.add([3, 4], encoder=CountingEncoder())
+        frame.add([5, 6], encoder=CountingEncoder())
+        self.assertEqual(6, frame.memory_usage)
+        self.assertIsInstance(frame.data[0].data, ds.BytesContent)
+        self.assertIsInstance(frame.data[1].data, ds.FileContent)
+        self.assertIsInstance(frame.data[2].data, ds.FileContent)
+        spill_dir = frame.spill_dir
+        frame.push()
+        attachments = self.get_data("test/spill")["attachments"]
+        self.assertEqual([b"[1, 2]", b"[3, 4]", b"[5, 6]"], [a["data"].value() for a in attachments])
+        del frame, attachments
+        self.protocol.data.clear()
+        gc.collect()
+        self.assertFalse(os.path.exists(spill_dir))
+
+    def test_push_pages(self):
+        pushes = []
+        handler = self.protocol.handler
+
+        def record(data, token):
+            pushes.append(data)
+            return handler(data, token)
+
+        self.protocol.handler = record
+        frame = ds.StackFrame(ds.create_context("test/pages"), access=None, auto_push=False,
+                              encryption=ds.NoEncryption(), page_size=2)
+        for i in range(5):
+            frame.add([i], encoder=CountingEncoder())
+        frame.push(ds.FrameMeta(message="pages"))
+
+        self.assertEqual(4, len(pushes))
+        self.assertEqual([0, 2, 4], [p["index"] for p in pushes[:3]])
+        self.assertEqual([2, 2, 1], [len(p["attachments"]) for p in pushes[:3]])
+        self.assertEqual(b"[4]", pushes[2]["attachments"][0]["data"].value())
+        self.assertEqual(5, pushes[3]["size"])
+        self.assertEqual("pages", pushes[3]["params"]["message"])
+        self.assertNotIn("attachments", pushes[3])
+        self.assertEqual(1, len({p["id"] for p in pushes}))
+
+    def test_push_pages_upload(self):
+        uploads = {}
+
+        class UploadProtocol(ds.JsonProtocol):
+            MAX_SIZE = 0
+
+            def do_request(self, endpoint, data, token, method="POST", stack=None):
+                offset = data.get("index", 0)
+                return {"url": "https://api.dstack.ai/test/pages",
+                        "attachments": [{"index": offset + i, "upload_url": f"https://upload/{offset + i}"}
+                                        for i in range(len(data.get("attachments", [])))]}
+
+            def do_upload(self, upload_url, d):
+                uploads[upload_url] = d.value()
+
+        setup_protocol(TestProtocolFactory(UploadProtocol("https://api.dstack.ai", True)))
+        frame = ds.StackFrame(ds.create_context("test/pages"), access=None, auto_push=False,
+                              encryption=ds.NoEncryption(), page_size=2)
+        for i in range(5):
+            frame.add([i], encoder=CountingEncoder())
+        frame.push()
+
+        self.assertEqual({f"https://upload/{i}": f"[{i}]".encode() for i in range(5)}, uploads)
+
+    def test_push_batch(self):
+        results = ds.push_batch([("test/plot_1", self.get_figure()),
+                                 {"stack": "test/plot_2", "obj": self.get_figure(), "params": {"x": 1},
+                                  "access": "public"},
+                                 ("test/unknown", object())])
+        self.assertEqual(["test/plot_1", "test/plot_2", "test/unknown"], [r.stack for r in results])
+        self.assertTrue(results[0].is_ok())
+        self.assertEqual("https://api.dstack.ai/user/test/plot_1", results[0].result.url)
+        self.assertEqual(1, self.get_data("test/plot_2")["attachments"][0]["params"]["x"])
+        self.assertEqual("public", self.get_data("test/plot_2")["access"])
+        self.assertFalse(results[2].is_ok())
+        self.assertNotIn("attachments", self.protocol.data["user/test/unknown"])
+
+    def test_push_batch_server_error(self):
+        self.protocol.broke()
+        results = ds.push_batch([("test/plot_1", self.get_figure())])
+        self.assertIsInstance(results[0].error, RuntimeError)
+        self.assertRaises(RuntimeError, ds.push_batch, [("test/plot_1", self.get_figure())], raise_errors=True)
+
+    def test_push_batch_checks_access_before_encoding(self):
+        encoder = CountingEncoder()
+        self.protocol.broke(PermissionError())
+        results = ds.push_batch([{"stack": "test/list", "obj": [1, 2], "encoder": encoder}])
+        self.assertIsInstance(results[0].error, PermissionError)
+        self.assertEqual(0, encoder.count)
+
     def assertFailed(self, func, *args):
         try:
             func(*args)
@@ -145,5 +341,26 @@ class StackFrameTest(TestBase):
         return fig
 
 
+evaluated = []
+
+
+def evaluate_slowly(x: int) -> list:
+    time.sleep(0.001)
+    evaluated.append(x)
+    return [x]
+
+
+class CountingEncoder(ds.Encoder[list]):
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def encode(self, obj: list, description: Optional[str], params: Optional[Dict]) -> ds.FrameData:
+        self.count += 1
+        if obj is None:
+            raise ValueError("None is not supported")
+        return ds.FrameData(ds.BytesContent(str(obj).encode()), ds.MediaType("text/plain"), description, params)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,34 @@
+import dstack as ds
+from tests import TestBase
+from tests.test_stack import CountingEncoder
+
+
+class TestWarm(TestBase):
+    def test_warm(self):
+        frame = ds.frame("test/warm_1")
+        frame.add([1], encoder=CountingEncoder(), x=1)
+        frame.add([2], encoder=CountingEncoder(), x=2)
+        frame.push()
+        ds.push("test/warm_2", [3], encoder=CountingEncoder())
+
+        report = ds.warm(["test/warm_1", "test/warm_2", "test/missing"])
+        self.assertEqual(3, report.attachments)
+        self.assertEqual(0, report.cached)
+        self.assertEqual(len(b"[1]") * 3, report.bytes)
+        self.assertEqual(1, len(report.errors))
+        self.assertEqual("test/missing", report.errors[0][0])
+
+        cache = ds.get_cache_manager()
+        head = self.get_data("test/warm_1")["id"]
+        self.assertIsNotNone(cache.get("user/test/warm_1", head, 1, {}))
+
+        hits = self.hits(cache, "user/test/warm_1")
+        report = ds.warm(["test/warm_1"], params=[{"x": 2}])
+        self.assertEqual(1, report.attachments)
+        self.assertEqual(1, report.cached)
+        self.assertEqual(0, report.bytes)
+        self.assertEqual(hits + 1, self.hits(cache, "user/test/warm_1"))
+
+    @staticmethod
+    def hits(cache: ds.CacheManager, stack: str) -> int:
+        return sum(s.hits for s in cache.stats() if s.stack == stack)